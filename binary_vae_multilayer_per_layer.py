@@ -199,6 +199,17 @@ def create_eta(num):
     )
 
 
+def uniform_noise(batch_size, num_latents, mode="iid"):
+    # "antithetic" pairs each row u with 1 - u, so rows stay marginally uniform
+    # and v is still derived from u by v_from_u.
+    if mode == "iid":
+        return tf.random_uniform([batch_size, num_latents], dtype=tf.float32)
+    elif mode == "antithetic":
+        half = tf.random_uniform([(batch_size + 1) // 2, num_latents], dtype=tf.float32)
+        return tf.concat([half, 1 - half], 0)[:batch_size]
+    raise ValueError("Unknown noise mode {!r}, expected 'iid' or 'antithetic'".format(mode))
+
+
 class BSampler:
     def __init__(self, u, name):
         self.u = u
@@ -246,7 +257,8 @@ def get_variables(tag, arr=None):
 def main(relaxation=None, learn_prior=True, max_iters=None,
          batch_size=24, num_latents=200, model_type=None, lr=None,
          test_bias=False, train_dir=None, iwae_samples=100, dataset="mnist",
-         logf=None, var_lr_scale=10., Q_wd=.0001, Q_depth=-1, checkpoint_path=None):
+         logf=None, var_lr_scale=10., Q_wd=.0001, Q_depth=-1, checkpoint_path=None,
+         noise="iid"):
 
     valid_batch_size = 100
 
@@ -292,7 +304,7 @@ def main(relaxation=None, learn_prior=True, max_iters=None,
 
     # random uniform samples
     u = [
-        tf.random_uniform([tf.shape(x)[0], num_latents], dtype=tf.float32)
+        uniform_noise(tf.shape(x)[0], num_latents, noise)
         for l in range(num_layers)
     ]
     # create binary sampler
@@ -580,6 +592,7 @@ if __name__ == "__main__":
     parser.add_argument("--var_lr_scale", type=float, default=10.)
     parser.add_argument("--Q_depth", type=int, default=-1)
     parser.add_argument("--Q_wd", type=float, default=0.0)
+    parser.add_argument("--noise", type=str, default="iid", choices=["iid", "antithetic"])
     FLAGS = parser.parse_args()
 
     td = FLAGS.train_dir
@@ -597,6 +610,7 @@ if __name__ == "__main__":
         f.write("{}: {}\n".format("max_iters", FLAGS.max_iters))
         f.write("{}: {}\n".format("dataset", FLAGS.dataset))
         f.write("{}: {}\n".format("var_lr_scale", FLAGS.var_lr_scale))
+        f.write("{}: {}\n".format("noise", FLAGS.noise))
         if FLAGS.relaxation != "rebar":
             f.write("{}: {}\n".format("Q_depth", FLAGS.Q_depth))
             f.write("{}: {}\n".format("Q_wd", FLAGS.Q_wd))
@@ -606,5 +620,6 @@ if __name__ == "__main__":
             relaxation=FLAGS.relaxation, train_dir=td, dataset=FLAGS.dataset,
             lr=FLAGS.lr, model_type=FLAGS.model, max_iters=FLAGS.max_iters,
             logf=logf, var_lr_scale=FLAGS.var_lr_scale,
-            Q_depth=FLAGS.Q_depth, Q_wd=FLAGS.Q_wd, checkpoint_path=FLAGS.checkpoint_path
+            Q_depth=FLAGS.Q_depth, Q_wd=FLAGS.Q_wd, checkpoint_path=FLAGS.checkpoint_path,
+            noise=FLAGS.noise
         )
@@ -499,8 +499,18 @@ class SBN(object):  # REINFORCE
 
   def _generate_randomness(self):
     for i in xrange(self.hparams.n_layer):
-      self.uniform_samples[i] = tf.stop_gradient(tf.random_uniform(
-          [self.batch_size, self.hparams.n_hidden]))
+      self.uniform_samples[i] = tf.stop_gradient(self._uniform_noise(
+          self.batch_size, self.hparams.n_hidden))
+
+  def _uniform_noise(self, batch_size, dim):
+    """Uniform noise, i.i.d. or paired as (u, 1 - u), according to
+    hparams.noise. Rows stay marginally uniform."""
+    if self.hparams.noise == 'iid':
+      return tf.random_uniform([batch_size, dim])
+    elif self.hparams.noise == 'antithetic':
+      half = tf.random_uniform([(batch_size + 1) // 2, dim])
+      return tf.concat([half, 1 - half], 0)[:batch_size]
+    raise ValueError('Unknown noise mode %s' % self.hparams.noise)
 
   def _u_to_v(self, log_alpha, u, eps = 1e-8):
     """Convert u to tied randomness in v."""
@@ -1341,4 +1351,5 @@ default_hparams = tf.contrib.training.HParams(model='SBNGumbel',
                              quadratic=True,
                              beta2=0.99999,
                              task='sbn',
+                             noise='iid', # 'iid' or 'antithetic'
                              )
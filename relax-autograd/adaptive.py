@@ -0,0 +1,121 @@
+from __future__ import absolute_import
+
+import autograd.numpy as np
+
+
+class SampleSizeController(object):
+    """Chooses the number of samples for each optimization step.
+
+    After each step, update() takes the per-sample gradients the estimator
+    returned, shape (N, D), and estimates the signal-to-noise ratio of their
+    mean, |E g|^2 / (tr Var g / N). Since that grows linearly with N, the next
+    step uses the N that would have hit target_snr, changed by at most a
+    factor of max_change per step and kept within [min_samples, max_samples];
+    max_samples is the per-step budget of f evaluations. With target_snr=None
+    N stays fixed and only evaluations are counted, which count() does for
+    gradients the estimator has already averaged over shared params.
+    """
+
+    def __init__(self, num_samples=10, target_snr=None, min_samples=2, max_samples=1000,
+                 max_change=2.0):
+        self.num_samples = num_samples
+        self.target_snr = target_snr
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.max_change = max_change
+        self.evaluations = 0
+        self.snr = None
+
+    def count(self, num_samples):
+        if self.target_snr is not None:
+            raise ValueError("target_snr needs per-sample gradients, so params must be "
+                             "tiled to one row per sample")
+        self.evaluations += num_samples
+        return self.num_samples
+
+    def update(self, grads):
+        num_samples = grads.shape[0]
+        self.evaluations += num_samples
+        total_var = np.sum(np.var(grads, axis=0, ddof=1))
+        # |mean|^2 overestimates |E g|^2 by tr Var g / N on average.
+        signal = np.sum(np.mean(grads, axis=0)**2) - total_var / num_samples
+        self.snr = signal * num_samples / total_var if total_var > 0 else np.inf
+        if self.target_snr is None:
+            return self.num_samples
+
+        if self.snr <= 0:
+            wanted = num_samples * self.max_change
+        elif np.isinf(self.snr):
+            wanted = num_samples / self.max_change
+        else:
+            wanted = num_samples * self.target_snr / self.snr
+        wanted = np.clip(wanted, num_samples / self.max_change, num_samples * self.max_change)
+        self.num_samples = int(np.clip(np.ceil(wanted), self.min_samples, self.max_samples))
+        return self.num_samples
+
+
+def adaptive_grad(mc_objective_and_var, controller):
+    """Wraps an estimate(combined_params, t, num_samples) -> (func_vals, grads,
+    grad_var) function into a combined_grad for adam, drawing
+    controller.num_samples samples each step. grads are per-sample, or
+    already averaged if the estimator was given params shared by all samples."""
+    def combined_grad(combined_params, t):
+        num_samples = controller.num_samples
+        obj_value, grad_obj, grad_var = mc_objective_and_var(combined_params, t, num_samples)
+        if np.ndim(grad_obj) == np.ndim(combined_params[0]):
+            controller.count(num_samples)
+            return (grad_obj, grad_var)
+        controller.update(grad_obj)
+        return (np.mean(grad_obj, axis=0), grad_var)
+    return combined_grad
+
+
+class VarianceGradientSchedule(object):
+    """Decides on which steps the estimator computes the gradient of its
+    variance w.r.t. est_params (variance_grad=True in relax_all and
+    rebar_all), the more expensive half of a step.
+
+    It is computed every `every` steps. With drift, it is also computed on
+    the step after the total gradient variance has moved by more than that
+    fraction from its value at the last such step, which needs each step's
+    per-sample gradients, shape (N, D), passed to update(); without drift
+    they may be averaged already. due(t) is read before the step.
+    """
+
+    def __init__(self, every=10, drift=None):
+        self.every = every
+        self.drift = drift
+        self.last_full = None
+        self.reference_var = None
+        self.drifted = False
+        self.full_steps = 0
+        self.steps = 0
+
+    def due(self, t):
+        return self.last_full is None or self.drifted or t - self.last_full >= self.every
+
+    def update(self, t, grads, variance_grad):
+        self.steps += 1
+        total_var = np.sum(np.var(grads, axis=0)) if self.drift is not None else None
+        if variance_grad:
+            self.full_steps += 1
+            self.last_full = t
+            self.reference_var = total_var
+            self.drifted = False
+        elif self.drift is not None and self.reference_var > 0:
+            self.drifted = abs(total_var / self.reference_var - 1) > self.drift
+
+
+def lazy_variance_grad(estimate, schedule):
+    """Wraps an estimate(combined_params, t, variance_grad) -> (func_vals,
+    grads, grad_var) function, e.g. one calling relax_all, into one of
+    (combined_params, t) that asks for the variance gradient only when
+    schedule is due. On the other steps grad_var is zeros, so adam leaves
+    est_params to their momentum."""
+    def lazy_estimate(combined_params, t, *args):
+        variance_grad = schedule.due(t)
+        func_vals, grads, grad_var = estimate(combined_params, t, *args,
+                                              variance_grad=variance_grad)
+        schedule.update(t, grads, variance_grad)
+        return func_vals, grads, grad_var
+    return lazy_estimate
@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+from collections import OrderedDict
+import time
+
+import numpy as onp
+from autograd.tracer import getval
+
+from relax import concrete_all, rebar_all, reinforce_all, relax_all, shares_params,\
+    zeros_like_tree
+
+ESTIMATORS = OrderedDict([('reinforce', reinforce_all), ('concrete', concrete_all),
+                          ('rebar', rebar_all), ('relax', relax_all)])
+
+
+class EstimatorSelector(object):
+    """Picks a gradient estimator as training goes on.
+
+    Called like rebar_all and relax_all, but with params tiled to one row
+    per sample and est_params a dict from estimator name to that
+    estimator's est_params. Every `every` calls it runs all the estimators,
+    timing each. They all use the same noise_u and noise_v (common random
+    numbers), so the comparison is not blurred by the draw. Then it switches
+    to the estimator with the lowest efficiency, the total variance of its
+    per-sample gradients times its seconds per call. That is the cost of
+    reaching a given variance of the averaged gradient. The other calls run
+    only the current estimator.
+
+    estimators maps names to functions with relax_all's signature and
+    outputs; by default all of ESTIMATORS except concrete, which is biased.
+    Names without an entry in est_params, such as reinforce, are given ().
+    The variance gradients returned have est_params' structure and are zero
+    except for the estimators that ran, so on probe steps every candidate's
+    est_params get trained, not just the current one's.
+
+    Each probe is appended to decisions, with the measurements and the
+    estimator chosen, and passed to log if one is given.
+    """
+
+    def __init__(self, estimators=None, every=100, log=None):
+        if estimators is None:
+            estimators = OrderedDict((name, ESTIMATORS[name])
+                                     for name in ('reinforce', 'rebar', 'relax'))
+        self.estimators = OrderedDict(estimators)
+        self.every = every
+        self.log = log
+        self.current = next(iter(self.estimators))
+        self.decisions = []
+        self.steps = 0
+
+    def __call__(self, params, est_params, noise_u, noise_v, f):
+        if shares_params(params, noise_u):
+            raise ValueError("EstimatorSelector compares per-sample gradient variances, so "
+                             "params must be tiled to one row per sample")
+        if self.steps % self.every == 0:
+            results = self.probe(params, est_params, noise_u, noise_v, f)
+        else:
+            results = {self.current: self.estimators[self.current](
+                params, est_params.get(self.current, ()), noise_u, noise_v, f)}
+        self.steps += 1
+        func_vals, grads, _ = results[self.current]
+        d_var = {name: results[name][2] if name in results else zeros_like_tree(value)
+                 for name, value in est_params.items()}
+        return func_vals, grads, d_var
+
+    def probe(self, params, est_params, noise_u, noise_v, f):
+        results, variance, seconds, efficiency = {}, {}, {}, {}
+        for name, estimator in self.estimators.items():
+            start = time.perf_counter()
+            results[name] = estimator(params, est_params.get(name, ()), noise_u, noise_v, f)
+            seconds[name] = time.perf_counter() - start
+            grads = getval(results[name][1])
+            variance[name] = float(onp.sum(onp.var(grads, axis=0)))
+            efficiency[name] = variance[name] * seconds[name]
+        previous, self.current = self.current, min(efficiency, key=efficiency.get)
+        decision = {'step': self.steps, 'previous': previous, 'chosen': self.current,
+                    'variance': variance, 'seconds': seconds, 'efficiency': efficiency}
+        self.decisions.append(decision)
+        if self.log:
+            self.log(decision)
+        return results
+
+
+def format_decision(decision):
+    # One line per probe, for EstimatorSelector(log=lambda d: print(format_decision(d))).
+    measured = ' '.join('{}={:.3g}'.format(name, value)
+                        for name, value in decision['efficiency'].items())
+    action = 'switch {} -> {}'.format(decision['previous'], decision['chosen']) \
+        if decision['chosen'] != decision['previous'] else 'keep {}'.format(decision['chosen'])
+    return 'Step {} {} (variance x seconds: {})'.format(decision['step'], action, measured)
@@ -0,0 +1,340 @@
+"""Backend-neutral REBAR and RELAX estimators.
+
+The estimators here are written once against a small array interface and run
+on either autograd or PyTorch (CPU), picked per call with `backend='autograd'`
+or `backend='torch'`. relax.rebar_all and relax.relax_all are these with
+`backend='autograd'` by default, and relax.py's other estimators use the
+sampling and surrogate functions below. Inputs may be NumPy arrays; results
+come back as arrays of the chosen backend, and f must accept and return those
+as well.
+"""
+from __future__ import absolute_import
+
+import numpy as onp
+import autograd.numpy as anp
+from autograd import make_vjp
+from autograd.tracer import isbox
+from autograd.scipy.special import expit as anp_expit, logit as anp_logit
+
+from profiling import count_f, counted, phase
+
+
+class AutogradBackend(object):
+    name = 'autograd'
+
+    exp = staticmethod(anp.exp)
+    expit = staticmethod(anp_expit)
+    logit = staticmethod(anp_logit)
+    dot = staticmethod(anp.dot)
+    relu = staticmethod(lambda x: anp.maximum(0, x))
+    concatenate = staticmethod(anp.concatenate)
+    logical_not = staticmethod(anp.logical_not)
+    zeros_like = staticmethod(anp.zeros_like)
+
+    def asarray(self, x):
+        # Leaves traced values alone, so the estimators can be differentiated.
+        return x if isbox(x) else anp.asarray(x)
+
+    def clip_unit(self, x):
+        info = onp.finfo(anp.result_type(x))
+        return anp.clip(x, info.tiny, 1 - info.epsneg)
+
+    def cast_like(self, x, like):
+        return anp.asarray(x, dtype=anp.result_type(like))
+
+    def signs(self, num_pos, num_neg, like):
+        # [1,...,1, -1,...,-1] along the first axis, shaped like `like`.
+        shape = anp.shape(like)[1:]
+        return anp.concatenate([anp.ones((num_pos,) + shape, dtype=like.dtype),
+                                -anp.ones((num_neg,) + shape, dtype=like.dtype)])
+
+    def make_vjp(self, fun, x):
+        vjp, ans = make_vjp(fun)(x)
+        return vjp, ans
+
+    def detach(self, x):
+        return x
+
+
+class TorchBackend(object):
+    name = 'torch'
+
+    def __init__(self):
+        import torch
+        self.torch = torch
+        self.exp = torch.exp
+        self.expit = torch.sigmoid
+        self.logit = torch.logit
+        self.dot = torch.matmul
+        self.relu = torch.relu
+        self.concatenate = torch.cat
+        self.logical_not = torch.logical_not
+        self.zeros_like = torch.zeros_like
+
+    def asarray(self, x):
+        # Keeps the dtype, as anp.asarray does; Python floats become float64.
+        if isinstance(x, self.torch.Tensor):
+            return x
+        return self.torch.as_tensor(onp.asarray(x))
+
+    def clip_unit(self, x):
+        info = self.torch.finfo(x.dtype)
+        return x.clamp(info.tiny, 1 - info.eps / 2)
+
+    def cast_like(self, x, like):
+        return x.to(like.dtype)
+
+    def signs(self, num_pos, num_neg, like):
+        shape = tuple(like.shape[1:])
+        return self.torch.cat([self.torch.ones((num_pos,) + shape, dtype=like.dtype),
+                               -self.torch.ones((num_neg,) + shape, dtype=like.dtype)])
+
+    def make_vjp(self, fun, x):
+        # Keeps the graph, so the returned gradients can be differentiated again.
+        leaves, unflatten = _flatten(x)
+        leaves = [leaf if leaf.requires_grad else leaf.detach().requires_grad_()
+                  for leaf in leaves]
+        ans = fun(unflatten(leaves))
+
+        def vjp(g):
+            grads = self.torch.autograd.grad(ans, leaves, grad_outputs=g,
+                                             create_graph=True, allow_unused=True)
+            return unflatten([self.torch.zeros_like(leaf) if grad is None else grad
+                              for leaf, grad in zip(leaves, grads)])
+        return vjp, ans
+
+    def detach(self, x):
+        return x.detach()
+
+
+def _flatten(tree):
+    # Leaves of nested lists and tuples, and a function to rebuild the nesting.
+    if isinstance(tree, (list, tuple)):
+        flat = [_flatten(subtree) for subtree in tree]
+        sizes = [len(leaves) for leaves, _ in flat]
+
+        def unflatten(leaves):
+            subtrees, start = [], 0
+            for size, (_, unflatten_subtree) in zip(sizes, flat):
+                subtrees.append(unflatten_subtree(leaves[start:start + size]))
+                start += size
+            return type(tree)(subtrees)
+        return [leaf for leaves, _ in flat for leaf in leaves], unflatten
+    return [tree], lambda leaves: leaves[0]
+
+def _map(fun, tree):
+    leaves, unflatten = _flatten(tree)
+    return unflatten([fun(leaf) for leaf in leaves])
+
+_backend_classes = {'autograd': AutogradBackend, 'torch': TorchBackend}
+_backends = {}
+
+def get_backend(backend):
+    # Accepts a backend name or an already constructed backend.
+    if not isinstance(backend, str):
+        return backend
+    if backend not in _backends:
+        if backend not in _backend_classes:
+            raise ValueError("Unknown backend {!r}, expected one of {}".format(
+                backend, sorted(_backend_classes)))
+        _backends[backend] = _backend_classes[backend]()
+    return _backends[backend]
+
+
+def clip_unit(x, backend='autograd'):
+    # Keeps x inside (0, 1) at its own precision, so logit(x) stays finite
+    # when a probability saturates; in float32 that happens much sooner.
+    return get_backend(backend).clip_unit(x)
+
+def bernoulli_sample(logit_theta, noise, backend='autograd'):
+    # b = H(z) as 0s and 1s in the dtype of noise.
+    B = get_backend(backend)
+    return B.cast_like(B.logit(noise) < logit_theta, noise)
+
+def conditional_noise(logit_theta, samples, noise, backend='autograd'):
+    # Computes p(u|b), where b = H(z), z = logit_theta + logit(noise), p(u) = U(0, 1)
+    B = get_backend(backend)
+    uprime = B.expit(-logit_theta)  # u' = 1 - theta
+    return samples * (noise * (1 - uprime) + uprime) + B.logical_not(samples) * noise * uprime
+
+def relaxed_bernoulli_sample(logit_theta, noise, log_temperature, backend='autograd'):
+    # sigma(z / t), with z = theta + logit(noise) as in the paper's code.
+    B = get_backend(backend)
+    return B.expit((B.expit(logit_theta) + B.logit(B.clip_unit(noise))) / B.exp(log_temperature))
+
+def bernoulli_logprob_grad(logit_theta, targets, backend='autograd'):
+    # Closed form of the gradient of log Bernoulli(targets | theta) w.r.t. logit_theta.
+    B = get_backend(backend)
+    return targets - B.expit(logit_theta)
+
+def nn_input_layer(layer, inputs, backend='autograd'):
+    # The first layer of nn_predict, dense (W, b) or low-rank (U, V, b).
+    B = get_backend(backend)
+    if len(layer) == 3:
+        U, V, b = layer
+        return B.dot(B.dot(inputs, U), V) + b
+    W, b = layer
+    return B.dot(inputs, W) + b
+
+def nn_predict(params, inputs, backend='autograd'):
+    B = get_backend(backend)
+    outputs = nn_input_layer(params[0], inputs, B)
+    for W, b in params[1:]:
+        outputs = B.dot(B.relu(outputs), W) + b
+    return outputs
+
+def leave_one_out_mean(func_vals):
+    # For each sample, the mean of the other samples' function values.
+    num_samples = func_vals.shape[0]
+    if num_samples < 2:
+        raise ValueError("leave-one-out baseline needs at least 2 samples, got {}".format(num_samples))
+    return (func_vals.sum(0) - func_vals) / (num_samples - 1)
+
+
+# The estimators accept params shared by all samples, e.g. shape (D,) with
+# noise of shape (N, D), as well as params tiled to (N, D). For shared params
+# the gradient estimate comes back already averaged over samples, with the
+# shape of params, and the variance gradient is estimated from that mean.
+
+def shares_params(params, noise):
+    return onp.ndim(params) < onp.ndim(noise)
+
+def combine_grads(params, noise, reinforce_term, grad_diff):
+    # Per-sample gradients, or their mean if params are shared by all samples,
+    # in which case the vjp has already summed grad_diff over samples.
+    if shares_params(params, noise):
+        return (reinforce_term.sum(0) + grad_diff) / noise.shape[0]
+    return reinforce_term + grad_diff
+
+def variance_cotangent(params, noise, grads):
+    # Cotangent for grads whose vjp estimates the gradient of the per-sample
+    # gradient variance. For the mean of N samples, E|mean|^2 differs from
+    # the per-sample second moment by a constant plus a factor of 1 / N.
+    if shares_params(params, noise):
+        return 2 * noise.shape[0] * grads
+    return 2 * grads / grads.shape[0]
+
+def relaxed_pair(params, relaxed, relaxed_cond, f, backend='autograd'):
+    # Returns f at z tilde, and the elementwise gradient of f(z) - f(z tilde),
+    # where relaxed and relaxed_cond map params to the relaxed z and z tilde.
+    # Both are evaluated in one stacked batch, so f is traced once.
+    B = get_backend(backend)
+
+    def stacked(params):
+        return f(B.concatenate([relaxed(params), relaxed_cond(params)]))
+
+    vjp, vals = B.make_vjp(stacked, params)
+    num_samples = vals.shape[0] // 2
+    return vals[num_samples:], vjp(B.signs(num_samples, num_samples, vals))
+
+def concrete_pair(params, log_temperature, samples, noise_u, noise_v, f, logit_noise_u=None,
+                  backend='autograd'):
+    # Returns f at z tilde, and the elementwise gradient of f(z) - f(z tilde).
+    # logit_noise_u, if given, is logit(noise_u), e.g. from a BernoulliSampler.
+    B = get_backend(backend)
+
+    def relaxed(params):
+        if logit_noise_u is None:
+            return relaxed_bernoulli_sample(params, noise_u, log_temperature, B)
+        return B.expit((B.expit(params) + logit_noise_u) / B.exp(log_temperature))
+
+    def relaxed_cond(params):
+        cond_noise = conditional_noise(params, samples, noise_v, B)
+        return relaxed_bernoulli_sample(params, cond_noise, log_temperature, B)
+
+    return relaxed_pair(params, relaxed, relaxed_cond, f, B)
+
+def rebar(params, est_params, samples, noise_u, noise_v, func_vals, f, logit_noise_u=None,
+          backend='autograd'):
+    B = get_backend(backend)
+    log_temperature, log_eta = est_params
+    eta = B.exp(log_eta)
+    f_cond, grad_diff = concrete_pair(params, log_temperature, samples, noise_u, noise_v,
+                                      lambda relaxed_samples: eta * f(relaxed_samples),
+                                      logit_noise_u, B)
+    return combine_grads(params, noise_u,
+                         (func_vals - f_cond) * bernoulli_logprob_grad(params, samples, B),
+                         grad_diff)
+
+def relax(params, est_params, samples, noise_u, noise_v, func_vals, f=None, logit_noise_u=None,
+          backend='autograd'):
+    # f is unused; it is there to give relax rebar's signature.
+    B = get_backend(backend)
+    log_temperature, nn_params = est_params
+    surrogate_cond, grad_diff = concrete_pair(
+        params, log_temperature, samples, noise_u, noise_v,
+        lambda relaxed_samples: nn_predict(nn_params, relaxed_samples, B), logit_noise_u, B)
+    return combine_grads(params, noise_u,
+                         (func_vals - surrogate_cond) * bernoulli_logprob_grad(params, samples, B),
+                         grad_diff)
+
+def submit_rows(executor, f, samples):
+    # One future per sample. executor is a concurrent.futures executor or any
+    # callable with the same signature as its submit method.
+    submit = getattr(executor, 'submit', executor)
+    return [submit(f, samples[i:i + 1]) for i in range(samples.shape[0])]
+
+def gather_rows(futures, backend='autograd'):
+    return get_backend(backend).concatenate([future.result() for future in futures])
+
+def _estimator_all(estimator, params, est_params, noise_u, noise_v, f, B, leave_one_out,
+                   variance_grad, executor, sampler):
+    name = estimator.__name__ + '_all'
+    if sampler is None:
+        params, noise_u, noise_v = B.asarray(params), B.asarray(noise_u), B.asarray(noise_v)
+        with phase(name + '.sample'):
+            samples, logit_noise_u = bernoulli_sample(params, noise_u, B), None
+    else:
+        with phase(name + '.sample'):
+            sampler.sample(params, noise_u)
+        params, noise_u, noise_v = B.asarray(params), B.asarray(noise_u), B.asarray(noise_v)
+        samples, logit_noise_u = B.asarray(sampler.samples), B.asarray(sampler.logit_u)
+    est_params = _map(B.asarray, est_params)
+
+    def estimate(est_params, func_vals):
+        return estimator(params, est_params, samples, noise_u, noise_v, func_vals, f,
+                         logit_noise_u, B)
+
+    if variance_grad:
+        trace = lambda func_vals: B.make_vjp(lambda est_params: estimate(est_params, func_vals),
+                                             est_params)
+    else:
+        trace = lambda func_vals: (None, estimate(est_params, func_vals))
+    if executor is None:
+        with phase(name + '.f'):
+            func_vals = counted(f)(samples)
+        baseline = leave_one_out_mean(func_vals) if leave_one_out else 0.0
+        with phase(name + '.trace'):
+            var_vjp, grads = trace(func_vals - baseline)
+    else:
+        # f is evaluated one sample per task while the surrogate terms, which
+        # do not depend on it, are computed; its REINFORCE term is added after.
+        with phase(name + '.submit'):
+            futures = submit_rows(executor, f, samples)
+            count_f(len(futures), len(futures))
+        with phase(name + '.trace'):
+            var_vjp, surrogate_grads = trace(0.0)
+        with phase(name + '.wait'):
+            func_vals = gather_rows(futures, B)
+        baseline = leave_one_out_mean(func_vals) if leave_one_out else 0.0
+        grads = surrogate_grads + combine_grads(
+            params, noise_u, (func_vals - baseline) * bernoulli_logprob_grad(params, samples, B), 0.0)
+    if var_vjp is None:
+        return _map(B.detach, (func_vals, grads, _map(B.zeros_like, est_params)))
+    with phase(name + '.vjp'):
+        d_var_d_est = var_vjp(variance_cotangent(params, noise_u, grads))
+    return _map(B.detach, (func_vals, grads, d_var_d_est))
+
+# Both take the options of relax.rebar_all and relax.relax_all, which call them.
+
+def rebar_all(params, est_params, noise_u, noise_v, f, backend='autograd', variance_grad=True,
+              sampler=None):
+    # Returns objective, gradients, and gradients of variance of gradients.
+    return _estimator_all(rebar, params, est_params, noise_u, noise_v, f, get_backend(backend),
+                          False, variance_grad, None, sampler)
+
+def relax_all(params, est_params, noise_u, noise_v, f, backend='autograd', leave_one_out=False,
+              executor=None, variance_grad=True, sampler=None):
+    # Returns objective, gradients, and gradients of variance of gradients.
+    return _estimator_all(relax, params, est_params, noise_u, noise_v, f, get_backend(backend),
+                          leave_one_out, variance_grad, executor, sampler)
@@ -0,0 +1,43 @@
+from __future__ import absolute_import
+from __future__ import print_function
+
+import autograd.numpy as np
+import autograd.numpy.random as npr
+import torch
+
+import backends
+from relax import init_nn_params
+from bench_fused import time_estimator
+
+
+if __name__ == '__main__':
+    num_hidden_units = 50
+    num_reps = 5
+
+    print("{:>6} {:>6} {:>6} {:>14} {:>11} {:>8} {:>10}".format(
+        "method", "D", "N", "autograd (ms)", "torch (ms)", "speedup", "max diff"))
+    for D, num_samples in [(100, 10), (1000, 100), (10000, 100)]:
+        rs = npr.RandomState(0)
+        params = np.tile(rs.randn(D), (num_samples, 1))
+        noise_u = rs.rand(num_samples, D)
+        noise_v = rs.rand(num_samples, D)
+        targets = np.linspace(0, 1, D)
+        torch_targets = torch.as_tensor(targets)
+
+        def objective(b):
+            return np.sum((b - targets)**2, axis=-1, keepdims=True)
+
+        def torch_objective(b):
+            return torch.sum((b - torch_targets)**2, dim=-1, keepdim=True)
+
+        for name, estimator, est_params in [
+                ("rebar", backends.rebar_all, (0.0, 0.0)),
+                ("relax", backends.relax_all, (0.0, init_nn_params(0.1, [D, num_hidden_units, 1])))]:
+            autograd_time, autograd_result = time_estimator(
+                estimator, (params, est_params, noise_u, noise_v, objective, 'autograd'), num_reps)
+            torch_time, torch_result = time_estimator(
+                estimator, (params, est_params, noise_u, noise_v, torch_objective, 'torch'), num_reps)
+            diff = np.max(np.abs(autograd_result[1] - torch_result[1].numpy()))
+            print("{:>6} {:>6} {:>6} {:>14.2f} {:>11.2f} {:>8.2f} {:>10.2e}".format(
+                name, D, num_samples, 1000 * autograd_time, 1000 * torch_time,
+                autograd_time / torch_time, diff))
@@ -0,0 +1,56 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import time
+
+import autograd.numpy as np
+import autograd.numpy.random as npr
+from autograd.misc import flatten
+
+from relax import init_nn_params, relax_all, relax_all_analytic
+
+
+def time_estimator(estimator, args, num_reps, num_repeats=5):
+    # Best of num_repeats averages, to damp out scheduler noise.
+    result = estimator(*args)
+    times = []
+    for _ in range(num_repeats):
+        start = time.time()
+        for _ in range(num_reps):
+            estimator(*args)
+        times.append((time.time() - start) / num_reps)
+    return min(times), result
+
+def max_abs_diff(a, b):
+    return max(np.max(np.abs(flatten(x)[0] - flatten(y)[0])) for x, y in zip(a, b))
+
+
+# Times relax_all, which traces the surrogate with autograd, against
+# relax_all_analytic, which has its derivatives written out by hand.
+
+if __name__ == '__main__':
+    num_samples = 10
+    num_reps = 20
+
+    print("{:>12} {:>6} {:>14} {:>14} {:>8} {:>10}".format(
+        "method", "D", "autodiff (ms)", "analytic (ms)", "speedup", "max diff"))
+    for D in [100, 1000, 10000]:
+        rs = npr.RandomState(0)
+        params = np.tile(rs.randn(D), (num_samples, 1))
+        noise_u = rs.rand(num_samples, D)
+        noise_v = rs.rand(num_samples, D)
+
+        def objective(b):
+            return np.sum((b - np.linspace(0, 1, D))**2, axis=-1, keepdims=True)
+
+        cases = []
+        for num_hidden_units in [5, 50, 200]:
+            est_params = (0.0, init_nn_params(0.1, [D, num_hidden_units, 1]))
+            cases.append(("relax-{}".format(num_hidden_units), relax_all, relax_all_analytic,
+                          est_params))
+        for name, orig, new, est_params in cases:
+            args = (params, est_params, noise_u, noise_v, objective)
+            orig_time, orig_result = time_estimator(orig, args, num_reps)
+            new_time, new_result = time_estimator(new, args, num_reps)
+            print("{:>12} {:>6} {:>14.2f} {:>14.2f} {:>8.2f} {:>10.2e}".format(
+                name, D, 1000 * orig_time, 1000 * new_time, orig_time / new_time,
+                max_abs_diff(orig_result, new_result)))
@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import time
+
+import autograd.numpy as np
+import autograd.numpy.random as npr
+
+from adaptive import VarianceGradientSchedule, lazy_variance_grad
+from flat import FlatParams, adam
+from relax import init_nn_params, relax_all
+
+
+def train(D, num_samples, num_hidden_units, num_iters, schedule):
+    # demo_relax's training loop. Returns seconds per step, and the mean
+    # total gradient variance and objective over the second half of training.
+    def objective(b):
+        return np.sum((b - np.linspace(0, 1, D))**2, axis=-1, keepdims=True)
+
+    def estimate(combined_params, t, variance_grad=True):
+        params, est_params = combined_params
+        params_rep = np.tile(params, (num_samples, 1))
+        rs = npr.RandomState(t)
+        return relax_all(params_rep, est_params, rs.rand(num_samples, D), rs.rand(num_samples, D),
+                         objective, variance_grad=variance_grad)
+
+    lazy_estimate = lazy_variance_grad(estimate, schedule)
+    history = []
+    def combined_grad(combined_params, t):
+        func_vals, grads, grad_var = lazy_estimate(combined_params, t)
+        history.append((np.mean(func_vals), np.sum(np.var(grads, axis=0))))
+        return (np.mean(grads, axis=0), grad_var)
+
+    init_combined_params = (np.zeros(D), (0.0, init_nn_params(0.1, [D, num_hidden_units, 1],
+                                                                    rs=npr.RandomState(0))))
+    start = time.time()
+    adam(combined_grad, FlatParams(init_combined_params), step_size=0.1, num_iters=num_iters)
+    seconds = (time.time() - start) / num_iters
+    objectives, variances = np.array(history[num_iters // 2:]).T
+    return seconds, np.mean(variances), np.mean(objectives)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Speed and gradient variance of computing the variance gradient lazily')
+    parser.add_argument('--dims', type=int, default=100)
+    parser.add_argument('--num-samples', type=int, default=10)
+    parser.add_argument('--hidden-units', type=int, default=5)
+    parser.add_argument('--num-iters', type=int, default=1000)
+    parser.add_argument('--every', type=int, nargs='+', default=[1, 2, 5, 10, 50])
+    parser.add_argument('--drift', type=float, nargs='*', default=[0.5],
+                        help='also run every=max(--every) with these drift thresholds')
+    args = parser.parse_args()
+
+    cases = [(every, None) for every in args.every]
+    cases += [(max(args.every), drift) for drift in args.drift]
+    print("{:>6} {:>6} {:>10} {:>8} {:>8} {:>12} {:>10} {:>10}".format(
+        "every", "drift", "step (ms)", "speedup", "full", "grad var", "var ratio", "objective"))
+    baseline = None
+    for every, drift in cases:
+        schedule = VarianceGradientSchedule(every=every, drift=drift)
+        seconds, variance, objective = train(args.dims, args.num_samples, args.hidden_units,
+                                             args.num_iters, schedule)
+        if baseline is None:
+            baseline = seconds, variance
+        print("{:>6} {:>6} {:>10.2f} {:>8.2f} {:>8.2f} {:>12.4e} {:>10.2f} {:>10.4f}".format(
+            every, str(drift), 1000 * seconds, baseline[0] / seconds,
+            schedule.full_steps / float(schedule.steps), variance, variance / baseline[1],
+            objective))
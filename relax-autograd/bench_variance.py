@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import json
+import time
+import tracemalloc
+
+import autograd.numpy as np
+import autograd.numpy.random as npr
+from autograd import grad
+from autograd.misc import flatten
+
+from relax import init_nn_params, rebar_all, relax_all
+
+
+def autodiff_var_grad(method, params, est_params, noise_u, noise_v, objective):
+    # "Autodiff through variance": differentiate the sample variance of the gradients.
+    def var_naive(est_params):
+        obj, grads, vargrads = method(params, est_params, noise_u, noise_v, objective)
+        return np.sum(np.var(grads, axis=0))
+    return grad(var_naive)(est_params)
+
+def single_sample_var_grad(method, params, est_params, noise_u, noise_v, objective):
+    # "Single-sample unbiased": the variance gradient the estimator returns itself.
+    return method(params, est_params, noise_u, noise_v, objective)[2]
+
+def measure(var_grad, method, D, num_samples, est_params, num_reps):
+    params = np.tile(np.zeros(D), (num_samples, 1))
+    targets = np.linspace(0, 1, D)
+
+    def objective(b):
+        return np.sum((b - targets)**2, axis=-1, keepdims=True)
+
+    def run(seed):
+        rs = npr.RandomState(seed)
+        noise_u = rs.rand(num_samples, D)
+        noise_v = rs.rand(num_samples, D)
+        return flatten(var_grad(method, params, est_params, noise_u, noise_v, objective))[0]
+
+    run(0)  # Warm up.
+    start = time.time()
+    estimates = np.array([run(seed) for seed in range(num_reps)])
+    seconds = (time.time() - start) / num_reps
+
+    tracemalloc.start()
+    run(0)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': seconds,
+            'peak_bytes': peak_bytes,
+            'estimate_variance': float(np.sum(np.var(estimates, axis=0))),
+            'estimate_mean_norm': float(np.linalg.norm(np.mean(estimates, axis=0)))}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time, memory and variance of the variance-gradient estimators')
+    parser.add_argument('--dims', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--num-samples', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--hidden-units', type=int, nargs='+', default=[5, 50])
+    parser.add_argument('--num-reps', type=int, default=10)
+    parser.add_argument('--output', default='variance_benchmark.jsonl')
+    args = parser.parse_args()
+
+    approaches = [('autodiff', autodiff_var_grad), ('single_sample', single_sample_var_grad)]
+    with open(args.output, 'w') as output:
+        for D in args.dims:
+            for num_samples in args.num_samples:
+                cells = [('rebar', rebar_all, None, (0.0, 0.0))]
+                cells += [('relax', relax_all, H, (0.0, init_nn_params(0.1, [D, H, 1])))
+                          for H in args.hidden_units]
+                for name, method, hidden_units, est_params in cells:
+                    for approach, var_grad in approaches:
+                        record = dict(estimator=name, approach=approach, D=D,
+                                      num_samples=num_samples, hidden_units=hidden_units)
+                        record.update(measure(var_grad, method, D, num_samples,
+                                              est_params, args.num_reps))
+                        output.write(json.dumps(record) + '\n')
+                        output.flush()
+                        print("{estimator:>5} {approach:>13} D={D:<5} N={num_samples:<4} "
+                              "H={hidden_units!s:<4} {seconds:8.4f}s {peak_bytes:>10}B "
+                              "var={estimate_variance:.3e}".format(**record))
@@ -0,0 +1,72 @@
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+import numpy as onp
+from autograd.tracer import isbox
+
+
+class CachedObjective(object):
+    """Memoizes an objective f over binary samples.
+
+    Wraps f for use with relax_all, rebar_all and the other estimators. A
+    call on a batch of binary samples, shape (N,) + sample_shape, packs each
+    sample into bytes with np.packbits, looks the distinct ones up in an LRU
+    store of at most max_size entries, and calls f once on the batch of
+    misses. Any other input, such as the relaxed samples rebar passes to f or
+    values being traced by autograd, goes straight to f.
+
+    Rows requested and found, whether from earlier calls or earlier in the
+    same batch, count as hits; hit_rate is hits / (hits + misses).
+    """
+
+    def __init__(self, f, max_size=100000):
+        self.f = f
+        self.max_size = max_size
+        self.store = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.calls = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / float(total) if total else 0.0
+
+    def __call__(self, samples):
+        if isbox(samples):
+            return self.f(samples)
+        samples = onp.asarray(samples)
+        if not onp.all((samples == 0) | (samples == 1)):
+            return self.f(samples)
+
+        num_samples, sample_shape = samples.shape[0], samples.shape[1:]
+        packed = onp.packbits(samples.reshape(num_samples, -1).astype(bool), axis=1)
+        keys = [(sample_shape, row.tobytes()) for row in packed]
+
+        found, missing = {}, OrderedDict()
+        for i, key in enumerate(keys):
+            if key in found or key in missing:
+                continue
+            if key in self.store:
+                self.store.move_to_end(key)
+                found[key] = self.store[key]
+            else:
+                missing[key] = i
+        self.misses += len(missing)
+        self.hits += num_samples - len(missing)
+
+        if missing:
+            self.calls += 1
+            miss_vals = self.f(samples[list(missing.values())])
+            for key, val in zip(missing, miss_vals):
+                found[key] = val
+                self.store[key] = val
+            while len(self.store) > self.max_size:
+                self.store.popitem(last=False)
+                self.evictions += 1
+        return onp.stack([found[key] for key in keys])
+
+    def clear(self):
+        self.store.clear()
@@ -0,0 +1,47 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import autograd.numpy as np
+import autograd.numpy.random as npr
+
+from autoselect import EstimatorSelector, format_decision
+from flat import FlatParams, adam
+from metrics import MetricsRecorder
+from noise import uniform_noise
+from relax import init_nn_params
+
+if __name__ == '__main__':
+
+    D = 100
+    num_hidden_units = 5
+    num_samples = 10
+    noise_mode = 'iid'  # or 'antithetic', 'sobol'
+    init_est_params = {'rebar': (1.0, 1.0),
+                       'relax': (0.0, init_nn_params(0.1, [D, num_hidden_units, 1]))}
+    init_combined_params = (np.zeros(D), init_est_params)
+
+    def objective(b):
+        return np.sum((b - np.linspace(0, 1, D))**2, axis=-1, keepdims=True)
+
+    selector = EstimatorSelector(every=100, log=lambda decision: print(format_decision(decision)))
+
+    def combined_grad(combined_params, t):
+        params, est_params = combined_params
+        params_rep = np.tile(params, (num_samples, 1))
+        noise_u, noise_v = uniform_noise(npr.RandomState(t), num_samples, D, noise_mode)
+        func_vals, grads, grad_var = selector(params_rep, est_params, noise_u, noise_v, objective)
+        recorder.record(t, objective=np.mean(func_vals),
+                        gradient_variance=np.sum(np.var(grads, axis=0)))
+        return (np.mean(grads, axis=0), grad_var)
+
+    # Plot with python metrics.py autoselect_metrics.jsonl [--follow]
+    recorder = MetricsRecorder(path='autoselect_metrics.jsonl', every=10)
+
+    def callback(combined_params, t, combined_gradient):
+        if recorder.due(t):
+            print("Iteration {} objective {} estimator {}".format(
+                t, recorder.latest['objective'], selector.current))
+
+    print("Optimizing...")
+    adam(combined_grad, FlatParams(init_combined_params), step_size=0.1, num_iters=2000,
+         callback=callback)
+    recorder.close()
@@ -1,15 +1,14 @@
 from __future__ import absolute_import
 from __future__ import print_function
-import matplotlib.pyplot as plt
-
 import autograd.numpy as np
 import autograd.numpy.random as npr
 from autograd.scipy.special import expit
 
-from autograd import grad, value_and_grad
+from autograd import grad
 from autograd.misc.optimizers import adam
 
-from relax import concrete
+from metrics import MetricsRecorder
+from relax import concrete, value_and_elementwise_grad
 
 if __name__ == '__main__':
 
@@ -27,49 +26,26 @@ if __name__ == '__main__':
         rs = npr.RandomState(t)
         noise_u = rs.rand(num_samples, D)
         objective_vals, grads = \
-            value_and_grad(concrete)(params_rep, est_params, noise_u, objective)
+            value_and_elementwise_grad(lambda p: concrete(p, est_params, noise_u, objective))(params_rep)
+        if recorder.due(t):
+            # Values are unboxed from the trace of grad(combined_obj) when recorded.
+            recorder.record(t, objective=np.mean(objective_vals), parameter_values=expit(params),
+                            average_gradient=np.mean(grads, axis=0),
+                            gradient_variance=np.var(grads, axis=0), temperature=est_params)
         return np.mean(objective_vals), np.var(grads, axis=0)
 
+    # Plot with python metrics.py concrete_metrics.jsonl [--follow]
+    recorder = MetricsRecorder(path='concrete_metrics.jsonl', every=10)
+
     def combined_obj(combined_params, t):
         # Combines objective value and variance of gradients.
         obj_value, grad_variances = mc_objective_and_var(combined_params, t)
         return obj_value
 
-    # Set up figure.
-    fig = plt.figure(figsize=(8, 8), facecolor='white')
-    ax1 = fig.add_subplot(411, frameon=False)
-    ax2 = fig.add_subplot(412, frameon=False)
-    ax3 = fig.add_subplot(413, frameon=False)
-    ax4 = fig.add_subplot(414, frameon=False)
-    plt.ion()
-    plt.show(block=False)
-
-    temperatures = []
     def callback(combined_params, t, combined_grads):
-        params, temperature = combined_params
-        grad_params, grad_temperature = combined_grads
-        temperatures.append(temperature)
-        if t % 10 == 0:
-            objective_val, grad_vars = mc_objective_and_var(combined_params, t)
-            print("Iteration {} objective {}".format(t, objective_val))
-            ax1.cla()
-            ax1.plot(expit(params), 'r')
-            ax1.set_ylabel('parameter values')
-            ax1.set_ylim([0, 1])
-            ax2.cla()
-            ax2.plot(grad_params, 'g')
-            ax2.set_ylabel('average gradient')
-            ax3.cla()
-            ax3.plot(grad_vars, 'b')
-            ax3.set_ylabel('gradient variance')
-            ax3.set_xlabel('parameter index')
-            ax4.cla()
-            ax4.plot(temperatures, 'b')
-            ax4.set_ylabel('temperature')
-
-            plt.draw()
-            plt.pause(1.0/30.0)
+        if recorder.due(t):
+            print("Iteration {} objective {}".format(t, recorder.latest['objective']))
 
     print("Optimizing...")
     adam(grad(combined_obj), init_params, step_size=0.1, num_iters=2000, callback=callback)
-    plt.pause(10.0)
\ No newline at end of file
+    recorder.close()
\ No newline at end of file
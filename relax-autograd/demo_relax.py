@@ -1,25 +1,16 @@
 from __future__ import absolute_import
 from __future__ import print_function
-import matplotlib.pyplot as plt
-
 import autograd.numpy as np
 import autograd.numpy.random as npr
 from autograd.scipy.special import expit, logit
-from autograd.misc.optimizers import adam
-
-from relax import init_nn_params, nn_predict, relax_all
-
-def make_one_d(f, d, full_d_input):
-    def oned(one_d_input):
-        c = full_d_input.copy()
-        c[d] = one_d_input
-        return f(c)
-    return oned
 
-def map_and_stack(f):
-    def mapped(inputs):
-        return np.stack([f(a) for a in inputs])
-    return mapped
+from adaptive import SampleSizeController, VarianceGradientSchedule, adaptive_grad,\
+    lazy_variance_grad
+from flat import AdamState, FlatParams, adam
+from metrics import MetricsRecorder
+from noise import uniform_noise
+from relax import init_nn_params, nn_slice, relax_all
+from warmstart import WarmStart, objective_key
 
 if __name__ == '__main__':
 
@@ -28,6 +19,14 @@ if __name__ == '__main__':
     num_hidden_units = 5
     rs = npr.RandomState(0)
     num_samples = 10
+    noise_mode = 'iid'  # or 'antithetic', 'sobol'
+    target_snr = None   # e.g. 1.0 to adapt num_samples to the gradient noise
+    variance_grad_every = 1  # e.g. 10 to compute the variance gradient every 10 steps
+    # With params shared by all samples the estimator returns the gradient
+    # already averaged over them. The sample-size controller and the
+    # gradient_variance metric need per-sample gradients, so params are tiled
+    # to (num_samples, D) when the controller adapts.
+    per_sample_grads = target_snr is not None
     init_est_params = (0.0, init_nn_params(0.1, [D, num_hidden_units, 1]))
     init_model_params = np.zeros(D)
     init_combined_params = (init_model_params, init_est_params)
@@ -35,67 +34,48 @@ if __name__ == '__main__':
     def objective(b):
         return np.sum((b - np.linspace(0, 1, D))**2, axis=-1, keepdims=True)
 
-    def mc_objective_and_var(combined_params, t):
+    def mc_objective_and_var(combined_params, t, num_samples=num_samples, variance_grad=True):
         params, est_params = combined_params
-        params_rep = np.tile(params, (num_samples, 1))
-        rs = npr.RandomState(t)
-        noise_u = rs.rand(num_samples, D)
-        noise_v = rs.rand(num_samples, D)
-        return relax_all(params_rep, est_params, noise_u, noise_v, objective)
+        params_rep = np.tile(params, (num_samples, 1)) if per_sample_grads else params
+        noise_u, noise_v = uniform_noise(npr.RandomState(t), num_samples, D, noise_mode)
+        func_vals, grads, grad_var = relax_all(params_rep, est_params, noise_u, noise_v, objective,
+                                               variance_grad=variance_grad)
+        if recorder.due(t):
+            log_temperature, nn_params = est_params
+            # Interior points only; logit(0) and logit(1) are infinite.
+            xrange = logit(np.linspace(0, 1, 202)[1:-1])
+            xgrid = logit(np.linspace(0, 1, 51)[1:-1])
+            mean_grads = np.mean(grads, axis=0) if per_sample_grads else grads
+            variance = {'gradient_variance': np.var(grads, axis=0)} if per_sample_grads else {}
+            recorder.record(t, objective=np.mean(func_vals), parameter_values=expit(params),
+                            average_gradient=mean_grads,
+                            temperature=np.exp(log_temperature),
+                            surrogate_slice=nn_slice(nn_params, params, (slice_dim,), (xrange,)),
+                            surrogate_surface=nn_slice(nn_params, params, (slice_dim, slice_dim + 1),
+                                                       (xgrid, xgrid)), **variance)
+        return func_vals, grads, grad_var
 
-    def combined_grad(combined_params, t):
-        obj_value, grad_obj, grad_var = mc_objective_and_var(combined_params, t)
-        return (np.mean(grad_obj, axis=0), grad_var)
+    # Plot with python metrics.py relax_metrics.jsonl [--follow]
+    recorder = MetricsRecorder(path='relax_metrics.jsonl', every=10)
+    controller = SampleSizeController(num_samples, target_snr, max_samples=1000)
+    schedule = VarianceGradientSchedule(every=variance_grad_every)
+    combined_grad = adaptive_grad(lazy_variance_grad(mc_objective_and_var, schedule), controller)
 
-    # Set up figure.
-    fig = plt.figure(figsize=(8, 8), facecolor='white')
-    ax1 = fig.add_subplot(511, frameon=False)
-    ax2 = fig.add_subplot(512, frameon=False)
-    ax3 = fig.add_subplot(513, frameon=False)
-    ax4 = fig.add_subplot(514, frameon=False)
-    ax5 = fig.add_subplot(515, frameon=False)
-
-    plt.ion()
-    plt.show(block=False)
-
-    temperatures = []
-    nn_scales = []
     def callback(combined_params, t, combined_gradient):
-        params, est_params = combined_params
-        grad_params, grad_est = combined_gradient
-        log_temperature, nn_params = est_params
-        temperatures.append(np.exp(log_temperature))
-        if t % 10 == 0:
-            objective_val, grads, est_grads = mc_objective_and_var(combined_params, t)
-            print("Iteration {} objective {}".format(t, np.mean(objective_val)))
-            ax1.cla()
-            ax1.plot(expit(params), 'r')
-            ax1.set_ylabel('parameter values')
-            ax1.set_xlabel('parameter index')
-            ax1.set_ylim([0, 1])
-            ax2.cla()
-            ax2.plot(grad_params, 'g')
-            ax2.set_ylabel('average gradient')
-            ax2.set_xlabel('parameter index')
-            ax3.cla()
-            ax3.plot(np.var(grads), 'b')
-            ax3.set_ylabel('gradient variance')
-            ax3.set_xlabel('parameter index')
-            ax4.cla()
-            ax4.plot(temperatures, 'b')
-            ax4.set_ylabel('temperature')
-            ax4.set_xlabel('iteration')
+        if recorder.due(t):
+            print("Iteration {} objective {} samples {} evaluations {}".format(
+                t, recorder.latest['objective'], controller.num_samples, controller.evaluations))
 
-            ax5.cla()
-            xrange = np.linspace(0, 1, 200)
-            f_tilde = lambda x: nn_predict(nn_params, x)
-            f_tilde_map = map_and_stack(make_one_d(f_tilde, slice_dim, params))
-            ax5.plot(xrange, f_tilde_map(logit(xrange)), 'b')
-            ax5.set_ylabel('1d slide of surrogate')
-            ax5.set_xlabel('relaxed sample')
-            plt.draw()
-            plt.pause(1.0/30.0)
+    # The surrogate, temperature and their adam moments carry over between
+    # runs on the same objective and sizes; delete warm_starts/ to start cold.
+    warm_start = WarmStart(objective_key(objective, D, num_hidden_units))
+    flat_params = FlatParams(init_combined_params)
+    adam_state = AdamState(flat_params)
+    if warm_start.load_flat(flat_params, adam_state):
+        print("Warm-started from {}".format(warm_start.path))
 
     print("Optimizing...")
-    adam(combined_grad, init_combined_params, step_size=0.1, num_iters=2000, callback=callback)
-    plt.pause(10.0)
+    adam(combined_grad, flat_params, step_size=0.1, num_iters=2000, callback=callback,
+         state=adam_state)
+    warm_start.save_flat(flat_params, adam_state)
+    recorder.close()
@@ -0,0 +1,38 @@
+from __future__ import absolute_import
+
+import numpy as onp
+
+
+def exact_expectation(f, logit_theta, block_bits=16):
+    """Exact E[f(b)] and its gradient w.r.t. logit_theta, for b ~ Bernoulli(expit(logit_theta)).
+
+    Enumerates all 2**D configurations in blocks of 2**block_bits rows. The
+    lowest block_bits variables vary within a block and their log-probabilities
+    are computed once; the remaining variables are stepped through in Gray-code
+    order, so moving to the next block flips one column of the block and one
+    term of the log-probability. f is called once per block on an array of
+    shape (2**block_bits, D).
+    """
+    logit_theta = onp.asarray(logit_theta, dtype=float)
+    D = logit_theta.shape[0]
+    low_bits = min(block_bits, D)
+
+    # log p(b) = sum_i log(1 - theta_i) + b . logit_theta
+    log_norm = -onp.sum(onp.logaddexp(0, logit_theta))
+    block = onp.zeros((2 ** low_bits, D))
+    block[:, :low_bits] = (onp.arange(2 ** low_bits)[:, None] >> onp.arange(low_bits)) & 1
+    low_logprobs = onp.dot(block[:, :low_bits], logit_theta[:low_bits]) + log_norm
+
+    value, weighted_samples = 0.0, onp.zeros(D)
+    high_logprob = 0.0
+    for k in range(2 ** (D - low_bits)):
+        if k > 0:
+            flip = low_bits + ((k & -k).bit_length() - 1)  # Gray code changes one bit.
+            block[:, flip] = 1 - block[0, flip]
+            high_logprob += logit_theta[flip] if block[0, flip] else -logit_theta[flip]
+        weighted_vals = onp.exp(low_logprobs + high_logprob) * onp.reshape(f(block), -1)
+        value += onp.sum(weighted_vals)
+        weighted_samples += onp.dot(weighted_vals, block)
+
+    # d/d logit_theta of p(b) is p(b) * (b - theta).
+    return value, weighted_samples - value / (1 + onp.exp(-logit_theta))
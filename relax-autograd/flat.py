@@ -0,0 +1,169 @@
+from __future__ import absolute_import
+
+import numpy as onp
+
+
+def _layout(tree, offset):
+    # Returns a spec of the tree's structure with each leaf's slice of the
+    # flat buffer, and the offset after the last leaf.
+    if isinstance(tree, (tuple, list)):
+        specs = []
+        for child in tree:
+            spec, offset = _layout(child, offset)
+            specs.append(spec)
+        return (type(tree), specs), offset
+    if isinstance(tree, dict):
+        keys = sorted(tree)
+        specs = []
+        for key in keys:
+            spec, offset = _layout(tree[key], offset)
+            specs.append(spec)
+        return (dict, keys, specs), offset
+    shape = onp.shape(tree)
+    stop = offset + int(onp.prod(shape))
+    return (None, offset, stop, shape), stop
+
+def _leaves(spec):
+    if spec[0] is None:
+        return [spec]
+    return [leaf for child in spec[-1] for leaf in _leaves(child)]
+
+def _views(spec, flat):
+    if spec[0] is None:
+        _, start, stop, shape = spec
+        return flat[start:stop].reshape(shape)
+    if spec[0] is dict:
+        _, keys, specs = spec
+        return {key: _views(child, flat) for key, child in zip(keys, specs)}
+    kind, specs = spec
+    return kind(_views(child, flat) for child in specs)
+
+def _pack(spec, tree, out):
+    if spec[0] is None:
+        _, start, stop, shape = spec
+        out[start:stop] = onp.reshape(tree, -1)
+    elif spec[0] is dict:
+        _, keys, specs = spec
+        for key, child in zip(keys, specs):
+            _pack(child, tree[key], out)
+    else:
+        for child, subtree in zip(spec[1], tree):
+            _pack(child, subtree, out)
+
+
+class FlatParams(object):
+    """Holds a tree of parameters, e.g. (params, (log_temperature, nn_params)),
+    in one contiguous buffer.
+
+    views has the structure of the tree, with every array replaced by a view
+    into buffer and every scalar by a 0-d view, so the estimators can be called
+    on it directly and see updates to buffer without copying. unpack gives
+    the same views into any other buffer of this layout, e.g. a gradient, and
+    pack writes a tree, e.g. the gradients an estimator returns, into one.
+    Leaves are ordered as in autograd.misc.flatten.
+    """
+
+    def __init__(self, tree, dtype=float):
+        self.spec, self.size = _layout(tree, 0)
+        self.buffer = onp.zeros(self.size, dtype)
+        self.views = self.unpack(self.buffer)
+        self.pack(tree, self.buffer)
+
+    def unpack(self, flat):
+        return _views(self.spec, flat)
+
+    def pack(self, tree, out=None):
+        if out is None:
+            out = onp.empty(self.size, self.buffer.dtype)
+        _pack(self.spec, tree, out)
+        return out
+
+    def span(self, *index):
+        # Slice of the flat layout holding the subtree at tree[index[0]][index[1]]...
+        spec = self.spec
+        for i in index:
+            spec = spec[-1][spec[1].index(i) if spec[0] is dict else i]
+        leaves = _leaves(spec)
+        return slice(leaves[0][1], leaves[-1][2]) if leaves else slice(0, 0)
+
+
+def flat_grad(grad, flat_params):
+    """Wraps grad(tree, i) so it is called on flat_params.views and its
+    result is written into a reused buffer in the flat layout. A grad that
+    already returns a flat array of that layout is passed through.
+
+    The estimators return their gradients as trees, built by autograd's VJPs,
+    so packing them still walks and copies the whole tree once per step.
+    That is one copy into a preallocated buffer, not a flatten and unflatten
+    with fresh allocations as in autograd.misc.optimizers."""
+    out = onp.empty_like(flat_params.buffer)
+    def flat_grad_fun(i):
+        g = grad(flat_params.views, i)
+        if isinstance(g, onp.ndarray) and g.shape == out.shape:
+            return g
+        return flat_params.pack(g, out)
+    return flat_grad_fun
+
+# The optimizers below follow autograd.misc.optimizers step for step, and
+# give the same iterates, but update flat_params.buffer in place and keep
+# their moments in preallocated buffers. callback gets the views of the
+# parameters and of the gradient; both are overwritten by later steps.
+
+def sgd(grad, flat_params, callback=None, num_iters=200, step_size=0.1, mass=0.9):
+    """Stochastic gradient descent with momentum."""
+    x = flat_params.buffer
+    grad = flat_grad(grad, flat_params)
+    velocity = onp.zeros_like(x)
+    scratch = onp.empty_like(x)
+    for i in range(num_iters):
+        g = grad(i)
+        if callback:
+            callback(flat_params.views, i, flat_params.unpack(g))
+        velocity *= mass
+        onp.multiply(g, 1.0 - mass, out=scratch)
+        velocity -= scratch
+        onp.multiply(velocity, step_size, out=scratch)
+        x += scratch
+    return flat_params
+
+class AdamState(object):
+    """adam's first and second moment estimates, in the flat layout of
+    flat_params, and the number of steps each entry has taken. Passing one
+    to adam continues from it, e.g. from moments loaded by warmstart.py."""
+
+    def __init__(self, flat_params):
+        self.m = onp.zeros_like(flat_params.buffer)
+        self.v = onp.zeros_like(flat_params.buffer)
+        self.steps = onp.zeros(flat_params.size, int)
+
+def adam(grad, flat_params, callback=None, num_iters=100, step_size=0.001, b1=0.9, b2=0.999,
+         eps=10**-8, state=None):
+    """Adam as described in http://arxiv.org/pdf/1412.6980.pdf."""
+    x = flat_params.buffer
+    grad = flat_grad(grad, flat_params)
+    state = state or AdamState(flat_params)
+    m, v = state.m, state.v
+    scratch = onp.empty_like(x)
+    step = onp.empty_like(x)
+    for i in range(num_iters):
+        g = grad(i)
+        if callback:
+            callback(flat_params.views, i, flat_params.unpack(g))
+        state.steps += 1
+        # Entries all warm- or cold-started share one bias correction.
+        steps = int(state.steps[0]) if state.steps.min() == state.steps.max() else state.steps
+        m *= b1                                  # First  moment estimate.
+        onp.multiply(g, 1 - b1, out=scratch)
+        m += scratch
+        v *= b2                                  # Second moment estimate.
+        onp.multiply(g, g, out=scratch)
+        scratch *= 1 - b2
+        v += scratch
+        onp.divide(v, 1 - b2 ** steps, out=scratch)  # Bias correction.
+        onp.sqrt(scratch, out=scratch)
+        scratch += eps
+        onp.divide(m, 1 - b1 ** steps, out=step)
+        step *= step_size
+        step /= scratch
+        x -= step
+    return flat_params
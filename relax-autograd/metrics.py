@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+from __future__ import print_function
+import argparse
+import collections
+import json
+
+import numpy as onp
+from autograd.tracer import getval
+
+
+class MetricsRecorder(object):
+    """Keeps the last capacity records of a training run, and writes every
+    record as a JSON line to path if one is given, so a run can be plotted
+    afterwards or while it runs by another process (see plot_metrics).
+
+    record takes values the training loop has already computed, so nothing
+    is re-estimated; values still being traced by autograd are unboxed.
+    Records are only kept every `every` iterations.
+    """
+
+    def __init__(self, capacity=1000, path=None, every=1):
+        self.records = collections.deque(maxlen=capacity)
+        self.every = every
+        self.file = open(path, 'w') if path else None
+
+    def due(self, t):
+        return t % self.every == 0
+
+    def record(self, t, **values):
+        if not self.due(t):
+            return
+        record = {name: onp.array(getval(value)) for name, value in values.items()}
+        record['iteration'] = onp.array(t)
+        self.records.append(record)
+        if self.file:
+            self.file.write(json.dumps({name: value.tolist() for name, value in record.items()}) + '\n')
+            self.file.flush()
+
+    @property
+    def latest(self):
+        return self.records[-1] if self.records else None
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def load_metrics(path):
+    with open(path) as f:
+        return [{name: onp.array(value) for name, value in json.loads(line).items()}
+                for line in f if line.endswith('\n')]
+
+def plot_metrics(records, fig):
+    # Scalars are plotted against iteration, vectors from the latest record
+    # against their index, and matrices from the latest record as images.
+    latest = records[-1]
+    names = sorted(name for name in latest if name != 'iteration')
+    fig.clf()
+    for i, name in enumerate(names):
+        ax = fig.add_subplot(len(names), 1, i + 1, frameon=False)
+        value = latest[name]
+        if value.ndim == 0:
+            ax.plot([r['iteration'] for r in records if name in r],
+                    [r[name] for r in records if name in r], 'b')
+            ax.set_xlabel('iteration')
+        elif value.ndim == 1:
+            ax.plot(value, 'b')
+            ax.set_xlabel('index')
+        else:
+            ax.imshow(value, aspect='auto', origin='lower')
+        ax.set_ylabel(name)
+    fig.suptitle('iteration {}'.format(int(latest['iteration'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plot the metrics a demo has written')
+    parser.add_argument('path')
+    parser.add_argument('--follow', action='store_true',
+                        help='keep re-reading the file while the run goes on')
+    args = parser.parse_args()
+
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figsize=(8, 8), facecolor='white')
+    while True:
+        records = load_metrics(args.path)
+        if records:
+            plot_metrics(records, fig)
+        if not args.follow:
+            plt.show()
+            break
+        plt.pause(1.0)
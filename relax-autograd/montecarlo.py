@@ -0,0 +1,127 @@
+from __future__ import absolute_import
+
+import multiprocessing
+
+import numpy as onp
+import autograd.numpy as np
+from autograd.misc import flatten
+
+
+def uniform_noise(seed, start, stop, sample_shape):
+    # noise_u and noise_v for samples start..stop-1 of a Philox stream. Each
+    # sample owns a fixed slice of the stream, so any chunking of the sample
+    # axis reproduces the same noise.
+    sample_size = 2 * int(onp.prod(sample_shape))
+    offset = start * sample_size
+    bit_generator = onp.random.Philox(key=seed)
+    bit_generator.advance(offset // 4)  # Philox draws 4 doubles per counter step.
+    rng = onp.random.Generator(bit_generator)
+    rng.random(offset % 4)
+    noise = rng.random((stop - start) * sample_size).reshape((stop - start, 2) + tuple(sample_shape))
+    return noise[:, 0], noise[:, 1]
+
+def chunk_ranges(num_samples, chunk_size):
+    return [(start, min(start + chunk_size, num_samples))
+            for start in range(0, num_samples, chunk_size)]
+
+def merge_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b):
+    # Combines the count, mean and sum of squared deviations of two batches.
+    count = count_a + count_b
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (count_b / count)
+    m2 = m2_a + m2_b + delta**2 * (count_a * count_b / count)
+    return count, mean, m2
+
+def merge_partials(partial_a, partial_b):
+    # Partials are (count, objective, grad_mean, grad_m2, flat d_var_d_est).
+    count_a, objective_a, mean_a, m2_a, d_var_a = partial_a
+    count_b, objective_b, mean_b, m2_b, d_var_b = partial_b
+    if count_a == 0:
+        return partial_b
+    count, mean, m2 = merge_moments(count_a, mean_a, m2_a, count_b, mean_b, m2_b)
+    weight = count_b / count
+    return (count, objective_a + weight * (objective_b - objective_a), mean, m2,
+            d_var_a + weight * (d_var_b - d_var_a))
+
+def mc_partial(estimator, params, est_params, f, ranges, seed):
+    # Accumulates the estimator's moments over a list of (start, stop) sample ranges.
+    partial = (0, 0.0, 0.0, 0.0, 0.0)
+    for start, stop in ranges:
+        noise_u, noise_v = uniform_noise(seed, start, stop, np.shape(params))
+        params_rep = np.tile(params, (stop - start,) + (1,) * np.ndim(params))
+        func_vals, grads, d_var_d_est = estimator(params_rep, est_params, noise_u, noise_v, f)
+        chunk_mean = np.mean(grads, axis=0)
+        partial = merge_partials(partial, (stop - start, np.mean(func_vals), chunk_mean,
+                                           np.sum((grads - chunk_mean)**2, axis=0),
+                                           flatten(d_var_d_est)[0]))
+    return partial
+
+def finish_partial(partial, est_params):
+    count, objective, grad_mean, grad_m2, d_var_flat = partial
+    return objective, grad_mean, grad_m2 / count, flatten(est_params)[1](d_var_flat)
+
+def chunked_mc(estimator, params, est_params, f, num_samples, chunk_size=1000, seed=0):
+    """Runs rebar_all, relax_all or any estimator with their signature over
+    num_samples samples, chunk_size at a time, so peak memory is set by
+    chunk_size rather than num_samples. params are unreplicated, e.g. shape
+    (D,). Returns the mean objective, the mean and variance of the per-sample
+    gradients, and the variance gradient for est_params."""
+    ranges = chunk_ranges(num_samples, chunk_size)
+    return finish_partial(mc_partial(estimator, params, est_params, f, ranges, seed), est_params)
+
+
+############### MULTI-PROCESS ##############
+
+_worker_state = {}
+
+def _init_worker(estimator, f):
+    # Runs once per worker. With the fork start method estimator and f are
+    # inherited rather than pickled, so closures are fine.
+    _worker_state['estimator'] = estimator
+    _worker_state['f'] = f
+
+def _worker_partial(args):
+    params, est_params, ranges, seed = args
+    return mc_partial(_worker_state['estimator'], params, est_params,
+                      _worker_state['f'], ranges, seed)
+
+class ParallelMC(object):
+    """Process-pool version of chunked_mc. The sample axis is split into
+    chunks that are dealt out to the workers; each worker gets params and
+    est_params once per call, runs its chunks, and sends back only its
+    partial moments. Noise comes from the same per-sample Philox slices as
+    chunked_mc, and the workers' partials are merged in shard order, so
+    results match it for any number of workers and are the same every call.
+
+    Workers are forked where the platform allows it, so estimator and f can
+    be closures. Elsewhere (Windows) they are spawned, and estimator and f
+    must be picklable, i.e. defined at module level."""
+
+    def __init__(self, estimator, f, num_workers=None, chunk_size=1000):
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        self.pool = context.Pool(self.num_workers, initializer=_init_worker,
+                                 initargs=(estimator, f))
+
+    def __call__(self, params, est_params, num_samples, seed=0):
+        ranges = chunk_ranges(num_samples, self.chunk_size)
+        shards = [ranges[i::self.num_workers] for i in range(self.num_workers)]
+        tasks = [(params, est_params, shard, seed) for shard in shards if shard]
+        partial = (0, 0.0, 0.0, 0.0, 0.0)
+        for worker_partial in self.pool.imap(_worker_partial, tasks):
+            partial = merge_partials(partial, worker_partial)
+        return finish_partial(partial, est_params)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
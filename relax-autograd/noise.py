@@ -0,0 +1,44 @@
+from __future__ import absolute_import
+
+import numpy as onp
+from scipy.stats import qmc
+
+NOISE_MODES = ('iid', 'antithetic', 'sobol')
+MAX_SOBOL_SIZE = 21201  # scipy's Sobol direction numbers stop there
+
+
+def uniform_noise(rs, num_samples, shape, mode='iid'):
+    """Returns noise_u and noise_v, each of shape (num_samples,) + shape.
+
+    'iid' draws independent uniforms, as rs.rand does. 'antithetic' pairs
+    each sample (u, v) with (1 - u, 1 - v). 'sobol' draws u and v from two
+    Sobol sequences, each with a fresh scramble taken from rs, so every
+    sample is still uniform with u independent of v and the estimators stay
+    unbiased. The sequences are drawn to the next power of 2 and cut to
+    num_samples, so it is most effective when num_samples is a power of 2,
+    and it supports shapes of up to MAX_SOBOL_SIZE elements. Only u and v are
+    changed, so conditional_noise and v_from_u apply to the result as before.
+    """
+    shape = (shape,) if onp.isscalar(shape) else tuple(shape)
+    size = int(onp.prod(shape))
+    if mode == 'iid':
+        # Same draws as rs.rand(num_samples, *shape) for u and then for v.
+        noise = onp.concatenate([rs.rand(num_samples, size), rs.rand(num_samples, size)], axis=1)
+    elif mode == 'antithetic':
+        half = rs.rand((num_samples + 1) // 2, 2 * size)
+        noise = onp.concatenate([half, 1 - half])[:num_samples]
+    elif mode == 'sobol':
+        if size > MAX_SOBOL_SIZE:
+            raise ValueError("'sobol' noise supports at most {} elements per sample, got {}; "
+                             "use 'iid' or 'antithetic'".format(MAX_SOBOL_SIZE, size))
+        # Rounding up to a power of 2 keeps scipy's balance warning quiet.
+        log2_samples = (int(num_samples) - 1).bit_length()
+        noise = onp.concatenate([qmc.Sobol(size, scramble=True, seed=rs.randint(2**31))
+                                 .random_base2(log2_samples)[:num_samples]
+                                 for _ in range(2)], axis=1)
+    else:
+        raise ValueError("Unknown noise mode {!r}, expected one of {}".format(mode, NOISE_MODES))
+    # Keep logit(noise) finite; iid draws from rs.rand can be exactly 0 as well.
+    noise = onp.clip(noise, onp.finfo(float).tiny, 1 - onp.finfo(float).epsneg)
+    noise = noise.reshape((num_samples, 2) + shape)
+    return noise[:, 0], noise[:, 1]
@@ -0,0 +1,110 @@
+from __future__ import absolute_import
+
+import collections
+import functools
+import json
+import time
+
+import numpy as onp
+
+# The Profile being recorded into, if any. Everything below checks this
+# first and does nothing else when it is None.
+_active = None
+
+
+class Profile(object):
+    """Collects call counts and cumulative wall time while active:
+
+        with Profile() as profile:
+            relax_all(params, est_params, noise_u, noise_v, f)
+        print(profile.to_json())
+
+    seconds and calls are keyed by estimator name ('relax_all') and by phase
+    within it ('relax_all.f', 'relax_all.vjp'). Phases of a function called
+    inside another, such as relax inside relax_all, are counted in both.
+    f_calls and f_rows count the calls to the objective and the samples
+    passed to it.
+    """
+
+    def __init__(self):
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.f_calls = 0
+        self.f_rows = 0
+
+    def add(self, name, seconds):
+        self.seconds[name] += seconds
+        self.calls[name] += 1
+
+    def __enter__(self):
+        global _active
+        self._previous, _active = _active, self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        _active = self._previous
+
+    def as_dict(self):
+        return {'seconds': dict(self.seconds), 'calls': dict(self.calls),
+                'f_calls': self.f_calls, 'f_rows': self.f_rows}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+class _Phase(object):
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.profile.add(self.name, time.perf_counter() - self.start)
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_null_phase = _NullPhase()
+
+def phase(name):
+    # Context manager timing a block as name.
+    return _null_phase if _active is None else _Phase(_active, name)
+
+def timed(fun):
+    # Times every call of fun under its name.
+    @functools.wraps(fun)
+    def timed_fun(*args, **kwargs):
+        if _active is None:
+            return fun(*args, **kwargs)
+        with _Phase(_active, fun.__name__):
+            return fun(*args, **kwargs)
+    return timed_fun
+
+
+def count_f(num_calls, num_rows):
+    if _active is not None:
+        _active.f_calls += num_calls
+        _active.f_rows += num_rows
+
+class _CountedObjective(object):
+    def __init__(self, f):
+        self.f = f
+
+    def __call__(self, inputs):
+        count_f(1, onp.shape(inputs)[0] if onp.ndim(inputs) > 1 else 1)
+        return self.f(inputs)
+
+def counted(f):
+    # Wraps an objective so its calls are counted, once however often it is
+    # wrapped. Returns f itself when profiling is off.
+    if _active is None or isinstance(f, _CountedObjective):
+        return f
+    return _CountedObjective(f)
@@ -1,8 +1,16 @@
 import autograd.numpy as np
 import autograd.numpy.random as npr
 
-from autograd.scipy.special import expit, logit
-from autograd import elementwise_grad, value_and_grad, make_vjp
+from autograd.scipy.special import expit, logit, logsumexp
+from autograd import elementwise_grad, make_vjp
+from autograd.extend import primitive, defvjp
+from autograd.misc import flatten
+
+import backends
+from backends import bernoulli_logprob_grad, bernoulli_sample, clip_unit, combine_grads,\
+    concrete_pair, conditional_noise, leave_one_out_mean, nn_input_layer, nn_predict,\
+    relaxed_bernoulli_sample, relaxed_pair, shares_params, variance_cotangent
+from profiling import counted, phase, timed
 
 
 def heaviside(z):
@@ -13,85 +21,227 @@ def softmax(z, log_temperature):
     return expit(z / temperature)
 
 def logistic_sample(noise, mu=0, sigma=1):
-    return mu + logit(noise) * sigma
+    return mu + logit(clip_unit(noise)) * sigma
 
 def logistic_logpdf(x, mu=0, scale=1):
     y = (x - mu) / (2 * scale)
     return -2 * np.logaddexp(y, -y) - np.log(scale)
 
-def bernoulli_sample(logit_theta, noise):
-    return logit(noise) < logit_theta
-
-def relaxed_bernoulli_sample(logit_theta, noise, log_temperature):
-    return softmax(logistic_sample(noise, expit(logit_theta)), log_temperature)
-
-def conditional_noise(logit_theta, samples, noise):
-    # Computes p(u|b), where b = H(z), z = logit_theta + logit(noise), p(u) = U(0, 1)
-    uprime = expit(-logit_theta)  # u' = 1 - theta
-    return samples * (noise * (1 - uprime) + uprime) + (1 - samples) * noise * uprime
-
 def bernoulli_logprob(logit_theta, targets):
     # log Bernoulli(targets | theta), targets are 0 or 1.
     return -np.logaddexp(0, -logit_theta * (targets * 2 - 1))
 
+def value_and_elementwise_grad(fun):
+    # Value and elementwise gradient of a function with one output per sample.
+    def value_and_grad_fun(x):
+        vjp, ans = make_vjp(fun)(x)
+        return ans, vjp(np.ones_like(ans))
+    return value_and_grad_fun
+
+def zeros_like_tree(tree):
+    if isinstance(tree, (tuple, list, dict)) and not tree:
+        return tree  # flatten warns on empty trees.
+    flat, unflatten = flatten(tree)
+    return unflatten(np.zeros_like(flat))
+
+
+############### DTYPE POLICY ###############
+# The estimators compute in the dtype of their inputs, so float32 params,
+# est_params and noise give float32 sampling, surrogate and estimator
+# arithmetic throughout. with_dtype casts them for one estimator, and
+# default_dtype, set with set_default_dtype, is used when it is given no
+# dtype and by init_nn_params. Called directly, the estimators expect f to
+# keep the dtype of its input in its values and gradients; with_dtype casts
+# both for any f.
+
+default_dtype = np.float64
+
+def set_default_dtype(dtype):
+    global default_dtype
+    default_dtype = np.dtype(dtype).type
+
+def cast_tree(tree, dtype, clip=False):
+    # Casts every array and scalar in a tree of lists and tuples, clipping
+    # them inside (0, 1) if clip is set, as for noise.
+    if isinstance(tree, (list, tuple)):
+        return type(tree)(cast_tree(x, dtype, clip) for x in tree)
+    tree = np.asarray(tree, dtype=dtype)
+    return clip_unit(tree) if clip else tree
+
+@primitive
+def keep_grad_dtype(x):
+    # The identity, but its gradient is cast to x's dtype, so an f that
+    # computes in float64 does not promote the gradients flowing back from it.
+    return x
+defvjp(keep_grad_dtype, lambda ans, x: lambda g: g.astype(np.result_type(x)))
+
+def with_dtype(estimator, dtype=None):
+    # Wraps an estimator with the signature of relax_all to run in dtype,
+    # or default_dtype. The values of f and the gradients through it are
+    # cast as well.
+    def estimator_in_dtype(params, est_params, noise_u, noise_v, f, **kwargs):
+        cast_dtype = dtype or default_dtype
+        def cast_f(samples):
+            if isinstance(samples, (list, tuple)):
+                samples = type(samples)(keep_grad_dtype(x) for x in samples)
+            else:
+                samples = keep_grad_dtype(samples)
+            return f(samples).astype(cast_dtype)
+        return estimator(cast_tree(params, cast_dtype), cast_tree(est_params, cast_dtype),
+                         cast_tree(noise_u, cast_dtype, clip=True),
+                         cast_tree(noise_v, cast_dtype, clip=True), cast_f, **kwargs)
+    return estimator_in_dtype
+
+def dtype_bias(estimator, params, est_params, noise_u, noise_v, f, dtype=np.float32, tol=1e-3):
+    # Runs estimator in float64 and in dtype on the same noise, and returns
+    # the difference of their mean gradients relative to the float64 one.
+    # Raises ValueError if that is more than tol.
+    def mean_grads(dtype):
+        grads = with_dtype(estimator, dtype)(params, est_params, noise_u, noise_v, f)[1]
+        if np.shape(grads) == np.shape(noise_u):
+            grads = np.mean(grads, axis=0)
+        return flatten(grads)[0].astype(np.float64)
+    reference = mean_grads(np.float64)
+    bias = np.linalg.norm(mean_grads(dtype) - reference) / np.linalg.norm(reference)
+    if bias > tol:
+        raise ValueError("{} gradients differ from float64 by {:.2e} relative, more than {:.2e}"
+                         .format(np.dtype(dtype).name, bias, tol))
+    return bias
+
 
 ############### REINFORCE ##################
 
-def reinforce(params, noise, func_vals):
-    samples = bernoulli_sample(params, noise)
-    return func_vals * elementwise_grad(bernoulli_logprob)(params, samples)
+@timed
+def reinforce(params, noise, func_vals, samples=None):
+    # Per-sample gradients, for shared params as well. samples, if the
+    # caller has them, are bernoulli_sample(params, noise).
+    if samples is None:
+        with phase('reinforce.sample'):
+            samples = bernoulli_sample(params, noise)
+    with phase('reinforce.score'):
+        return func_vals * bernoulli_logprob_grad(params, samples)
+
+def reinforce_all(params, est_params, noise_u, noise_v, f):
+    # Same signature and outputs as rebar_all and relax_all. REINFORCE has
+    # nothing to tune, so the variance gradients are zeros.
+    samples = bernoulli_sample(params, noise_u)
+    with phase('reinforce_all.f'):
+        func_vals = counted(f)(samples)
+    grads = reinforce(params, noise_u, func_vals, samples)
+    if shares_params(params, noise_u):
+        grads = np.mean(grads, axis=0)
+    return func_vals, grads, zeros_like_tree(est_params)
 
 
 ############### CONCRETE ###################
 
+@timed
 def concrete(params, log_temperature, noise, f):
-    relaxed_samples = relaxed_bernoulli_sample(params, noise, log_temperature)
-    return f(relaxed_samples)
+    with phase('concrete.sample'):
+        relaxed_samples = relaxed_bernoulli_sample(params, noise, log_temperature)
+    with phase('concrete.f'):
+        return f(relaxed_samples)
+
+def concrete_all(params, log_temperature, noise_u, noise_v, f):
+    # Same signature and outputs as rebar_all and relax_all, with est_params
+    # the log temperature. The gradients are biased. Lowering their variance
+    # would mean raising the temperature and the bias with it, so the
+    # variance gradient is zero and the temperature stays fixed.
+    with phase('concrete_all.f'):
+        func_vals = counted(f)(bernoulli_sample(params, noise_u))
+    grads = elementwise_grad(concrete)(params, log_temperature, noise_u, f)
+    if shares_params(params, noise_u):
+        grads = grads / noise_u.shape[0]  # the mean, not the sum over samples
+    return func_vals, grads, zeros_like_tree(log_temperature)
 
 
 ############### REBAR ######################
 
-def rebar(params, est_params, noise_u, noise_v, f):
+@timed
+def rebar(params, est_params, noise_u, noise_v, f, samples=None):
+    # Per-sample gradients from three separate traces, as in the paper's
+    # code; rebar_all computes the same with one. samples are as for reinforce.
+    f = counted(f)
     log_temperature, log_eta = est_params
     eta = np.exp(log_eta)
-    samples = bernoulli_sample(params, noise_u)
+    if samples is None:
+        with phase('rebar.sample'):
+            samples = bernoulli_sample(params, noise_u)
 
     def concrete_cond(params):
         cond_noise = conditional_noise(params, samples, noise_v)
         return concrete(params, log_temperature, cond_noise, f)
 
-    grad_concrete = elementwise_grad(concrete)(params, log_temperature, noise_u, f)
-    f_cond, grad_concrete_cond = value_and_grad(concrete_cond)(params)
-    return reinforce(params, noise_u, f(samples) - eta * f_cond) + \
-           eta * (grad_concrete - grad_concrete_cond)
-
-def rebar_all(params, est_params, noise_u, noise_v, f):
+    with phase('rebar.concrete'):
+        grad_concrete = elementwise_grad(concrete)(params, log_temperature, noise_u, f)
+    with phase('rebar.concrete_cond'):
+        f_cond, grad_concrete_cond = value_and_elementwise_grad(concrete_cond)(params)
+    with phase('rebar.f'):
+        func_vals = f(samples)
+    return combine_grads(params, noise_u,
+                         reinforce(params, noise_u, func_vals - eta * f_cond, samples),
+                         eta * (grad_concrete - grad_concrete_cond))
+
+@timed
+def rebar_all(params, est_params, noise_u, noise_v, f, variance_grad=True, sampler=None,
+              backend='autograd'):
     # Returns objective, gradients, and gradients of variance of gradients.
-    func_vals = f(bernoulli_sample(params, noise_u))
-    var_vjp, grads = make_vjp(rebar, argnum=1)(params, est_params, noise_u, noise_v, f)
-    d_var_d_est = var_vjp(2 * grads / grads.shape[0])
-    return func_vals, grads, d_var_d_est
+    # params may have a row per sample or be shared by all samples, e.g.
+    # shape (D,) with noise of shape (N, D); then the gradients come back
+    # averaged over samples. This holds for every *_all estimator here.
+    # The control variate is evaluated at z and z tilde in one stacked batch
+    # and traced once, by backends.rebar_all in the given backend ('autograd',
+    # 'torch'); f then takes and returns that backend's arrays.
+    # With variance_grad=False the estimator is not traced and the variance
+    # gradients are zeros, which roughly halves the cost of a step.
+    # Pass a BernoulliSampler to reuse its buffers across steps.
+    return backends.rebar_all(params, est_params, noise_u, noise_v, f, backend,
+                              variance_grad=variance_grad, sampler=sampler)
 
 
 ############### RELAX ######################
 # Uses a neural network for control variate instead of original objective
 
-def init_nn_params(scale, layer_sizes, rs=npr.RandomState(0)):
-    """Build a list of (weights, biases) tuples, one for each layer."""
-    return [(rs.randn(insize, outsize) * scale,   # weight matrix
-             rs.randn(outsize) * scale)           # bias vector
-            for insize, outsize in zip(layer_sizes[:-1], layer_sizes[1:])]
+def init_nn_params(scale, layer_sizes, rs=npr.RandomState(0), dtype=None, rank=None):
+    """Build a list of (weights, biases) tuples, one for each layer.
+    With rank, the first layer is (U, V, biases) instead, with weights U V
+    of that rank (see WIDE INPUTS below)."""
+    dtype = dtype or default_dtype
+    params = [((rs.randn(insize, outsize) * scale).astype(dtype),   # weight matrix
+               (rs.randn(outsize) * scale).astype(dtype))           # bias vector
+              for insize, outsize in zip(layer_sizes[:-1], layer_sizes[1:])]
+    if rank is not None:
+        _, b = params[0]
+        U = (rs.randn(layer_sizes[0], rank) * scale).astype(dtype)
+        V = (rs.randn(rank, layer_sizes[1]) / np.sqrt(rank)).astype(dtype)
+        params[0] = (U, V, b)
+    return params
 
 relu = lambda x: np.maximum(0, x)
 
-def nn_predict(params, inputs):
-    for W, b in params:
-        outputs = np.dot(inputs, W) + b
-        inputs = relu(outputs)
-    return outputs
-
-def relax(params, est_params, noise_u, noise_v, func_vals):
-    samples = bernoulli_sample(params, noise_u)
+def nn_slice(params, base, dims, grids):
+    # nn_predict on inputs equal to base except along dims, which take every
+    # combination of values in grids: dims=(i,) and one grid give a
+    # (len(grid),) slice, dims=(i, j) and two grids a (len(grid_i),
+    # len(grid_j)) surface. The first layer is linear, so only the change
+    # along dims is added to base's activations; the full inputs are never built.
+    outputs = nn_input_layer(params[0], base)
+    for i, (d, grid) in enumerate(zip(dims, grids)):
+        shape = [1] * (len(dims) + 1)
+        shape[i] = len(grid)
+        outputs = outputs + np.reshape(grid - base[d], shape) * input_weight_row(params[0], d)
+    rest = params[1:]
+    for W, b in rest:
+        outputs = np.dot(relu(outputs), W) + b
+    return outputs[..., 0]
+
+@timed
+def relax(params, est_params, noise_u, noise_v, func_vals, samples=None):
+    # Per-sample gradients from separate traces, as rebar; relax_all
+    # computes the same with one.
+    if samples is None:
+        with phase('relax.sample'):
+            samples = bernoulli_sample(params, noise_u)
     log_temperature, nn_params = est_params
 
     def surrogate(relaxed_samples):
@@ -101,14 +251,388 @@ def relax(params, est_params, noise_u, noise_v, func_vals):
         cond_noise = conditional_noise(params, samples, noise_v)  # z tilde
         return concrete(params, log_temperature, cond_noise, surrogate)
 
-    grad_surrogate = elementwise_grad(concrete)(params, log_temperature, noise_u, surrogate)
-    surrogate_cond, grad_surrogate_cond = value_and_grad(surrogate_cond)(params)
-    return reinforce(params, noise_u, func_vals - surrogate_cond) + \
-           grad_surrogate - grad_surrogate_cond
+    with phase('relax.surrogate'):
+        grad_surrogate = elementwise_grad(concrete)(params, log_temperature, noise_u, surrogate)
+    with phase('relax.surrogate_cond'):
+        surrogate_cond, grad_surrogate_cond = value_and_elementwise_grad(surrogate_cond)(params)
+    return combine_grads(params, noise_u,
+                         reinforce(params, noise_u, func_vals - surrogate_cond, samples),
+                         grad_surrogate - grad_surrogate_cond)
+
+@timed
+def relax_all(params, est_params, noise_u, noise_v, f, leave_one_out=False, executor=None,
+              variance_grad=True, sampler=None, backend='autograd'):
+    # Returns objective, gradients, and gradients of variance of gradients,
+    # computed as in rebar_all with the surrogate as the control variate.
+    # With leave_one_out, each sample's REINFORCE term also subtracts the mean
+    # of the other samples' function values, which keeps it unbiased.
+    # With an executor, f is evaluated one sample per task while the
+    # surrogate terms are computed; they do not depend on f, and the REINFORCE
+    # term of f is added once the futures resolve.
+    # variance_grad, sampler and backend are as for rebar_all.
+    return backends.relax_all(params, est_params, noise_u, noise_v, f, backend,
+                              leave_one_out=leave_one_out, executor=executor,
+                              variance_grad=variance_grad, sampler=sampler)
+
+
+############### WIDE INPUTS ################
+# For very high-dimensional samples the first layer dominates the cost of
+# the surrogate, its input gradient and their VJPs, all O(N D H). A first
+# layer (U, V, b) in nn_params computes (inputs U) V + b instead, O(N D r)
+# for rank r. nn_predict, relax, relax_all, nn_slice and the backends take
+# it unchanged; the hand-derived estimators and the multi-layer surrogates
+# need dense (W, b) layers and say so.
+
+def input_weight_row(layer, d):
+    # Row d of the first layer's weights, U[d] V for a low-rank layer.
+    if len(layer) == 3:
+        U, V, b = layer
+        return np.dot(U[d], V)
+    return layer[0][d]
+
+def check_dense(nn_params, caller):
+    if any(len(layer) != 2 for layer in nn_params):
+        raise ValueError("{} needs dense (W, b) surrogate layers; low-rank (U, V, b) "
+                         "layers are supported by relax, relax_all and nn_slice".format(caller))
+
+
+############### SAMPLER STATE ##############
+
+class BernoulliSampler(object):
+    """Buffers for the parts of a Bernoulli step that do not depend on the
+    estimator parameters: theta, u', logit(u), b = H(z), the conditional noise
+    v hat, z and z tilde, and the derivatives of z and z tilde w.r.t. params.
+    update() recomputes them all in place, so a long run reuses the same
+    arrays every step and each is computed once per step; values from the
+    previous step are overwritten. z and z tilde are views into one stacked
+    array zs, since relax_all_analytic evaluates the surrogate on both.
+    sample() recomputes only logit(u) and b, all that rebar_all and
+    relax_all use."""
+
+    def __init__(self):
+        self.shapes = None
+
+    def allocate(self, params_shape, noise_shape, dtype=float):
+        self.shapes = (params_shape, noise_shape, dtype)
+        self.logit_u, self.samples = [np.empty(noise_shape, dtype) for _ in range(2)]
+        self.theta = None  # the rest are allocated by the first update()
+
+    def allocate_update(self):
+        params_shape, noise_shape, dtype = self.shapes
+        num_samples = noise_shape[0]
+        self.theta, self.uprime, self.dtheta = [np.empty(params_shape, dtype) for _ in range(3)]
+        self.cond_noise, self.scratch = [np.empty(noise_shape, dtype) for _ in range(2)]
+        self.zs = np.empty((2 * num_samples,) + tuple(noise_shape[1:]), dtype)
+        self.dzs = np.empty_like(self.zs)
+        self.z, self.z_cond = self.zs[:num_samples], self.zs[num_samples:]
+        self.dz, self.dz_cond = self.dzs[:num_samples], self.dzs[num_samples:]
+
+    def sample(self, params, noise_u):
+        dtype = np.result_type(params, noise_u)
+        if self.shapes != (np.shape(params), np.shape(noise_u), dtype):
+            self.allocate(np.shape(params), np.shape(noise_u), dtype)
+        # Noise clipped as in clip_unit, so z is finite as in relaxed_bernoulli_sample.
+        info = np.finfo(dtype)
+        np.clip(noise_u, info.tiny, 1 - info.epsneg, out=self.logit_u)
+        logit(self.logit_u, out=self.logit_u)
+        np.less(self.logit_u, params, out=self.samples)
+        return self
+
+    def update(self, params, noise_u, noise_v):
+        self.sample(params, noise_u)
+        if self.theta is None:
+            self.allocate_update()
+        theta, uprime, dtheta, scratch = self.theta, self.uprime, self.dtheta, self.scratch
+        expit(params, out=theta)
+        expit(np.negative(params, out=uprime), out=uprime)  # u' = 1 - theta
+        np.multiply(theta, uprime, out=dtheta)
+
+        # v hat = v u' + b (v theta + u' - v u'), as in conditional_noise.
+        cond_noise = self.cond_noise
+        np.multiply(noise_v, uprime, out=cond_noise)
+        np.multiply(noise_v, theta, out=scratch)
+        np.add(scratch, uprime, out=scratch)
+        np.subtract(scratch, cond_noise, out=scratch)
+        np.multiply(scratch, self.samples, out=scratch)
+        np.add(cond_noise, scratch, out=cond_noise)
+
+        np.add(theta, self.logit_u, out=self.z)
+        np.add(theta, logit(cond_noise, out=self.z_cond), out=self.z_cond)
+
+        # dz = dtheta, dz tilde = dtheta - (v + b (1 - 2 v)) dtheta / (v hat (1 - v hat)).
+        self.dz[...] = dtheta
+        dz_cond = self.dz_cond
+        np.multiply(noise_v, -2, out=dz_cond)
+        np.add(dz_cond, 1, out=dz_cond)
+        np.multiply(dz_cond, self.samples, out=dz_cond)
+        np.add(dz_cond, noise_v, out=dz_cond)
+        np.multiply(dz_cond, dtheta, out=dz_cond)
+        np.subtract(1, cond_noise, out=scratch)
+        np.multiply(scratch, cond_noise, out=scratch)
+        np.divide(dz_cond, scratch, out=dz_cond)
+        np.subtract(dtheta, dz_cond, out=dz_cond)
+        return self
+
+
+############### RELAX, HAND-DERIVED ########
+# Same estimates as relax_all, but every derivative of the nn_predict surrogate
+# (input gradients, parameter gradients and the mixed second derivative needed
+# for the variance gradient) is written out by hand and batched over samples,
+# so autograd never traces it. nn_predict is piecewise linear, so its Hessian
+# with respect to its inputs is zero almost everywhere.  Assumes a scalar
+# surrogate output, i.e. layer sizes ending in 1.
+
+def nn_forward(params, inputs):
+    # Returns outputs, plus each layer's inputs and relu masks for the backward pass.
+    check_dense(params, 'relax_all_analytic')
+    layer_inputs, masks = [], []
+    for W, b in params:
+        layer_inputs.append(inputs)
+        outputs = np.dot(inputs, W) + b
+        masks.append(outputs > 0)
+        inputs = outputs * masks[-1]
+    return outputs, (layer_inputs, masks)
+
+def nn_backward(params, cache, output_grad):
+    # Cotangents of each layer's pre-activations, given the cotangent of the outputs.
+    layer_inputs, masks = cache
+    deltas = [output_grad]
+    for (W, _), mask in zip(params[:0:-1], masks[-2::-1]):
+        deltas.append(np.dot(deltas[-1], W.T) * mask)
+    return deltas[::-1]
+
+def nn_input_grad(params, deltas):
+    return np.dot(deltas[0], params[0][0].T)
+
+def nn_param_grad(cache, deltas):
+    layer_inputs, masks = cache
+    return [(np.dot(x.T, delta), np.sum(delta, axis=0))
+            for x, delta in zip(layer_inputs, deltas)]
+
+def nn_mixed_param_grad(params, cache, deltas, direction):
+    # Gradient w.r.t. the weights of sum_n <d nn_predict / d inputs_n, direction_n>,
+    # where deltas are the backward cotangents for an output gradient of ones.
+    layer_inputs, masks = cache
+    grads, tangent = [], direction
+    for (W, b), mask, delta in zip(params, masks, deltas):
+        grads.append((np.dot(tangent.T, delta), np.zeros_like(b)))
+        tangent = np.dot(tangent, W) * mask
+    return grads
+
+def sum_to_shape(x, shape):
+    # Sums out the dimensions of x that were broadcast from shape.
+    x = np.sum(x, axis=tuple(range(np.ndim(x) - len(shape))))
+    axes = tuple(i for i, size in enumerate(shape) if size == 1 and np.shape(x)[i] != 1)
+    return np.reshape(np.sum(x, axis=axes, keepdims=True), shape)
+
+def relax_all_analytic(params, est_params, noise_u, noise_v, f, leave_one_out=False,
+                       sampler=None):
+    # Drop-in replacement for relax_all. Pass a BernoulliSampler to reuse its
+    # buffers across steps.
+    log_temperature, nn_params = est_params
+    temperature = np.exp(log_temperature)
+    num_samples = noise_u.shape[0]
+
+    sampler = (sampler or BernoulliSampler()).update(params, noise_u, noise_v)
+    samples = sampler.samples
+    func_vals = f(samples)
+
+    # Surrogate at z and z tilde in one batch.
+    zs = sampler.zs
+    relaxed = expit(zs / temperature)
+    surrogate_vals, cache = nn_forward(nn_params, relaxed)
+    deltas = nn_backward(nn_params, cache, np.ones_like(surrogate_vals))
+    input_grads = nn_input_grad(nn_params, deltas)
+
+    drelaxed = relaxed * (1 - relaxed) / temperature
+    dparams = sampler.dzs * drelaxed   # d relaxed / d params, signed
+    dparams[num_samples:] *= -1
+    surrogate_cond = surrogate_vals[num_samples:]
+    score = samples - sampler.theta
+    grad_diff = input_grads * dparams
+    baseline = leave_one_out_mean(func_vals) if leave_one_out else 0.0
+    sample_grads = (func_vals - baseline - surrogate_cond) * score \
+                   + grad_diff[:num_samples] + grad_diff[num_samples:]
+
+    # Gradient of the sum of squared gradients, i.e. var_vjp(2 * grads / N),
+    # or of N times the squared mean if params are shared by all samples.
+    if shares_params(params, noise_u):
+        grads = np.mean(sample_grads, axis=0)
+        grads_weight = 2 * np.broadcast_to(grads, np.shape(sample_grads))
+    else:
+        grads = sample_grads
+        grads_weight = 2 * grads / num_samples
+    cond_weight = -np.sum(grads_weight * score, axis=-1, keepdims=True)
+    weights = np.concatenate([grads_weight, grads_weight])
+
+    drelaxed_dlogt = -drelaxed * zs
+    ddparams_dlogt = -dparams * ((1 - 2 * relaxed) * zs / temperature + 1)
+    d_var_d_logt = np.sum(weights * input_grads * ddparams_dlogt, axis=0) \
+                   + np.sum(cond_weight * input_grads[num_samples:] * drelaxed_dlogt[num_samples:], axis=0)
+
+    output_weights = np.concatenate([np.zeros_like(cond_weight), cond_weight])
+    cond_grads = nn_param_grad(cache, [delta * output_weights for delta in deltas])
+    mixed_grads = nn_mixed_param_grad(nn_params, cache, deltas, weights * dparams)
+    d_var_d_nn = [(dW1 + dW2, db1 + db2) for (dW1, db1), (dW2, db2) in zip(cond_grads, mixed_grads)]
+    return func_vals, grads, (sum_to_shape(d_var_d_logt, np.shape(log_temperature)), d_var_d_nn)
+
+
+############### CATEGORICAL ################
+# One-hot analogues of the Bernoulli estimators above, for K-way choices.
+# params are logits of shape (..., K) and noise has the same shape, e.g.
+# (samples, variables, K); f takes one-hot samples of that shape.
+
+def gumbel_sample(noise, mu=0):
+    return mu - np.log(-np.log(noise))
+
+def categorical_sample(logits, noise):
+    # One-hot argmax of the Gumbel-perturbed logits.
+    z = gumbel_sample(noise, logits)
+    return z >= np.max(z, axis=-1, keepdims=True)
+
+def tempered_softmax(z, log_temperature):
+    z = z / np.exp(log_temperature)
+    return np.exp(z - logsumexp(z, axis=-1, keepdims=True))
+
+def relaxed_categorical_sample(logits, noise, log_temperature):
+    return tempered_softmax(gumbel_sample(noise, logits), log_temperature)
+
+def conditional_gumbel(logits, samples, noise):
+    # Samples z tilde ~ p(z|b), where b = one_hot(argmax z), z = logits + gumbel(noise).
+    # The argmax is a Gumbel at logsumexp(logits); the rest are truncated below it.
+    z_top = logsumexp(logits, axis=-1, keepdims=True) \
+            - np.log(-np.log(np.sum(samples * noise, axis=-1, keepdims=True)))
+    z_rest = -np.logaddexp(np.log(-np.log(noise)) - logits, -z_top)
+    return samples * z_top + (1 - samples) * z_rest
+
+def categorical_logprob(logits, targets):
+    return np.sum(targets * (logits - logsumexp(logits, axis=-1, keepdims=True)), axis=-1)
+
+def categorical_logprob_grad(logits, targets):
+    # Closed form of elementwise_grad(categorical_logprob) w.r.t. logits.
+    return targets - np.exp(logits - logsumexp(logits, axis=-1, keepdims=True))
+
+def per_sample(x, like):
+    # Reshapes per-sample values, e.g. of shape (N, 1), to broadcast against like.
+    return np.reshape(x, (np.shape(x)[0],) + (1,) * (np.ndim(like) - 1))
+
+def categorical_pair(params, log_temperature, samples, noise_u, noise_v, f):
+    # Returns f at z tilde, and the elementwise gradient of f(z) - f(z tilde).
+    def relaxed(params):
+        return relaxed_categorical_sample(params, noise_u, log_temperature)
+
+    def relaxed_cond(params):
+        return tempered_softmax(conditional_gumbel(params, samples, noise_v), log_temperature)
+
+    return relaxed_pair(params, relaxed, relaxed_cond, f)
+
+def rebar_categorical(params, est_params, samples, noise_u, noise_v, func_vals, f):
+    log_temperature, log_eta = est_params
+    eta = np.exp(log_eta)
+    eta_f = lambda relaxed_samples: eta * f(relaxed_samples)
+    f_cond, grad_diff = categorical_pair(params, log_temperature, samples, noise_u, noise_v, eta_f)
+    return combine_grads(params, noise_u, per_sample(func_vals - f_cond, noise_u) *
+                         categorical_logprob_grad(params, samples), grad_diff)
 
-def relax_all(params, est_params, noise_u, noise_v, f):
-    # Returns objective, gradients, and gradients of variance of gradients.
-    func_vals = f(bernoulli_sample(params, noise_u))
-    var_vjp, grads = make_vjp(relax, argnum=1)(params, est_params, noise_u, noise_v, func_vals)
-    d_var_d_est = var_vjp(2 * grads / grads.shape[0])
+def relax_categorical(params, est_params, samples, noise_u, noise_v, func_vals):
+    log_temperature, nn_params = est_params
+    surrogate = lambda relaxed_samples: nn_predict(
+        nn_params, np.reshape(relaxed_samples, (np.shape(relaxed_samples)[0], -1)))
+    surrogate_cond, grad_diff = categorical_pair(params, log_temperature, samples,
+                                                 noise_u, noise_v, surrogate)
+    return combine_grads(params, noise_u, per_sample(func_vals - surrogate_cond, noise_u) *
+                         categorical_logprob_grad(params, samples), grad_diff)
+
+def rebar_categorical_all(params, est_params, noise_u, noise_v, f):
+    # Categorical counterpart of rebar_all.
+    samples = categorical_sample(params, noise_u).astype(noise_u.dtype)
+    func_vals = f(samples)
+    var_vjp, grads = make_vjp(rebar_categorical, argnum=1)(params, est_params, samples,
+                                                           noise_u, noise_v, func_vals, f)
+    d_var_d_est = var_vjp(variance_cotangent(params, noise_u, grads))
+    return func_vals, grads, d_var_d_est
+
+def relax_categorical_all(params, est_params, noise_u, noise_v, f):
+    # Categorical counterpart of relax_all. The surrogate sees the relaxed
+    # samples flattened to (N, variables * K), so its first layer has that many inputs.
+    samples = categorical_sample(params, noise_u).astype(noise_u.dtype)
+    func_vals = f(samples)
+    var_vjp, grads = make_vjp(relax_categorical, argnum=1)(params, est_params, samples,
+                                                           noise_u, noise_v, func_vals)
+    d_var_d_est = var_vjp(variance_cotangent(params, noise_u, grads))
+    return func_vals, grads, d_var_d_est
+
+
+############### MULTI-LAYER ################
+# A stack of conditionally dependent Bernoulli layers b_0, ..., b_{L-1}. b_0
+# has logits top_logits, and layer l > 0 has logits (2 b_{l-1} - 1) W_l + c_l,
+# as in the linear layers of binary_vae_multilayer_per_layer.py:
+#     params = (top_logits, [(W_1, c_1), ..., (W_{L-1}, c_{L-1})])
+# noise_u and noise_v are lists with one (N, D_l) array per layer, and f takes
+# the list of hard samples. Each layer has its own temperature and surrogate
+# c_l(sigma(z_l / t_l), b_0, ..., b_{l-1}), with the hard samples as 2 b - 1:
+#     est_params = ([log_temperature_l], [nn_params_l])
+# where the first layer of nn_params_l has D_l + D_0 + ... + D_{l-1} inputs.
+# Every term uses the one hard forward pass, and each surrogate only needs
+# layer l relaxed, so a step costs O(L) surrogate passes rather than a soft
+# pass through the rest of the stack for every layer.
+
+def layer_logits(layer_params, prev_samples):
+    W, c = layer_params
+    return np.dot(2 * prev_samples - 1, W) + c
+
+def multilayer_sample(params, noise_u):
+    # The hard forward pass: samples of every layer, each of shape (N, D_l).
+    top_logits, layers = params
+    samples = [bernoulli_sample(top_logits, noise_u[0]).astype(noise_u[0].dtype)]
+    for layer, noise in zip(layers, noise_u[1:]):
+        samples.append(bernoulli_sample(layer_logits(layer, samples[-1]), noise).astype(noise.dtype))
+    return samples
+
+def multilayer_logits(params, samples):
+    # Logits of every layer given the samples above it, concatenated to
+    # shape (N, D_0 + ... + D_{L-1}).
+    top_logits, layers = params
+    return np.concatenate([top_logits + np.zeros(np.shape(samples[0]), dtype=samples[0].dtype)] +
+                          [layer_logits(layer, prev) for layer, prev in zip(layers, samples[:-1])],
+                          axis=1)
+
+def relax_multilayer(logits, est_params, samples, noise_u, noise_v, func_vals):
+    # Per-sample RELAX gradients for the concatenated logits of all layers.
+    log_temperatures, surrogate_params = est_params
+    hard_inputs = np.zeros((np.shape(func_vals)[0], 0), dtype=samples[0].dtype)
+    grads = []
+    for l, nn_params in enumerate(surrogate_params):
+        check_dense(nn_params, 'relax_multilayer')
+        num_relaxed = np.shape(samples[l])[-1]
+        theta = logits[:, hard_inputs.shape[1]:hard_inputs.shape[1] + num_relaxed]
+        # The hard inputs are the same for z and z tilde, so their share of
+        # the first layer is computed once for both halves of the stacked batch.
+        (W_in, b_in), rest = nn_params[0], nn_params[1:]
+        activations = np.dot(hard_inputs, W_in[num_relaxed:]) + b_in
+        activations = np.concatenate([activations, activations])
+
+        def surrogate(relaxed):
+            outputs = np.dot(relaxed, W_in[:num_relaxed]) + activations
+            for W, b in rest:
+                outputs = np.dot(relu(outputs), W) + b
+            return outputs
+
+        surrogate_cond, grad_diff = concrete_pair(theta, log_temperatures[l], samples[l],
+                                                  noise_u[l], noise_v[l], surrogate)
+        grads.append((func_vals - surrogate_cond) * bernoulli_logprob_grad(theta, samples[l])
+                     + grad_diff)
+        hard_inputs = np.concatenate([hard_inputs, 2 * samples[l] - 1], axis=1)
+    return np.concatenate(grads, axis=1)
+
+def relax_multilayer_all(params, est_params, noise_u, noise_v, f):
+    # Returns objective, the gradient for params averaged over samples, and
+    # the gradient of the variance of the per-sample logit gradients.
+    samples = multilayer_sample(params, noise_u)
+    func_vals = f(samples)
+    logits_vjp, logits = make_vjp(multilayer_logits)(params, samples)
+    var_vjp, logit_grads = make_vjp(relax_multilayer, argnum=1)(logits, est_params, samples,
+                                                                noise_u, noise_v, func_vals)
+    grads = logits_vjp(logit_grads / logit_grads.shape[0])
+    d_var_d_est = var_vjp(2 * logit_grads / logit_grads.shape[0])
     return func_vals, grads, d_var_d_est
@@ -1,14 +1,25 @@
 from __future__ import absolute_import
 from __future__ import print_function
 import itertools
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import autograd.numpy as np
 import autograd.numpy.random as npr
-from autograd.scipy.special import expit, logit
+from autograd.scipy.special import logit, logsumexp
 from autograd import grad
+from autograd.misc import flatten
 
 from relax import reinforce, concrete, bernoulli_sample,\
-    relax_all, init_nn_params, rebar, rebar_all
+    relax_all, init_nn_params, rebar, rebar_all,\
+    rebar_categorical_all, relax_categorical_all, relax_multilayer_all,\
+    with_dtype, dtype_bias
+from montecarlo import ParallelMC, chunked_mc
+from exact import exact_expectation
+from autoselect import EstimatorSelector, format_decision
+from cache import CachedObjective
+from noise import uniform_noise
 
 
 if __name__ == '__main__':
@@ -20,28 +31,72 @@ if __name__ == '__main__':
     def objective(b):
         return np.sum((b - np.linspace(0.2, 0.9, D))**2, axis=-1, keepdims=True)
 
-    def expected_objective(params):
-        lst = list(itertools.product([0.0, 1.0], repeat=D))
-        return sum([objective(np.array(b)) * np.prod([expit(params[i] * (b[i] * 2.0 - 1.0))
-                    for i in range(D)]) for b in lst])
-
-    def mc(params, estimator):  # Simple Monte Carlo
+    def mc(params, estimator):  # Simple Monte Carlo, the estimators average over samples
         rs = npr.RandomState(0)
         noise = rs.rand(num_samples, D)
-        params_rep = np.tile(params, (num_samples, 1))
-        objective_vals = estimator(params_rep, noise, objective)
-        return np.mean(objective_vals, axis=0)
+        return estimator(params, noise, objective)
 
     print("Gradient estimators:")
-    print("Exact              : {}".format(grad(expected_objective)(params)))
-    print("Reinforce          : {}".format(mc(params, lambda p, n, o: reinforce(p, n, objective(bernoulli_sample(p, n))))))
-    print("Concrete, temp = 1 : {}".format(grad(mc)(params, lambda p, n, o: concrete(p, np.log(1), n, o))))
+    print("Exact              : {}".format(exact_expectation(objective, params)[1]))
+    print("Reinforce          : {}".format(mc(params, lambda p, n, o: np.mean(reinforce(p, n, objective(bernoulli_sample(p, n))), axis=0))))
+    print("Concrete, temp = 1 : {}".format(grad(mc)(params, lambda p, n, o: np.mean(concrete(p, np.log(1), n, o)))))
     print("Rebar, temp = 1    : {}".format(mc(params, lambda p, n, o: rebar(p, (np.log(1.0),  np.log(0.3)), n, rs.rand(num_samples, D), o))))
     print("Rebar, temp = 10   : {}".format(mc(params, lambda p, n, o: rebar(p, (np.log(10.0), np.log(0.3)), n, rs.rand(num_samples, D), o))))
     print("Rebar, eta = 0     : {}".format(mc(params, lambda p, n, o: rebar(p, (np.log(1.0),  np.log(0.0001)), n, rs.rand(num_samples, D), o))))
+    fused_rs = npr.RandomState(0)
+    rebar_args = (params, (np.log(1.0), np.log(0.3)),
+                  fused_rs.rand(num_samples, D), fused_rs.rand(num_samples, D), objective)
+    rebar_all_grads = rebar_all(*rebar_args)[1]
+    print("Rebar, one trace   : {}".format(rebar_all_grads))
+    print("  same as rebar    : {}".format(np.allclose(rebar_all_grads, rebar(*rebar_args))))
     nn_params = init_nn_params(0.1, [D, 5, 1])
     print("Relax              : {}".format(mc(params, lambda p, n, o: relax_all(p, (0.0, nn_params), n, rs.rand(num_samples, D), o)[1])))
+    print("Relax, leave-1-out : {}".format(mc(params, lambda p, n, o: relax_all(p, (0.0, nn_params), n, rs.rand(num_samples, D), o,
+                                                                                 leave_one_out=True)[1])))
+    noise_rs = npr.RandomState(0)
+    print("Relax, tiled       : {}".format(np.mean(relax_all(np.tile(params, (num_samples, 1)), (0.0, nn_params),
+                                                             noise_rs.rand(num_samples, D), rs.rand(num_samples, D),
+                                                             objective)[1], axis=0)))
+    print("Relax, chunked     : {}".format(chunked_mc(relax_all, params, (0.0, nn_params), objective,
+                                                      num_samples, chunk_size=1000)[1]))
+    with ParallelMC(relax_all, objective, num_workers=2, chunk_size=1000) as parallel_mc:
+        print("Relax, 2 processes : {}".format(parallel_mc(params, (0.0, nn_params), num_samples)[1]))
+    cached_objective = CachedObjective(objective)
+    print("Relax, cached f    : {}".format(mc(params, lambda p, n, o: relax_all(p, (0.0, nn_params), n, rs.rand(num_samples, D),
+                                                                                 cached_objective)[1])))
+    print("  f cache hit rate : {} ({} calls)".format(cached_objective.hit_rate, cached_objective.calls))
+    relax_float32 = with_dtype(relax_all, np.float32)
+    print("Relax, float32     : {}".format(mc(params, lambda p, n, o: relax_float32(p, (0.0, nn_params), n, rs.rand(num_samples, D), o)[1])))
+    print("  bias vs float64  : {}".format(dtype_bias(relax_all, params, (0.0, nn_params),
+                                                      rs.rand(num_samples, D), rs.rand(num_samples, D), objective)))
+    dtype_rs = npr.RandomState(0)
+    rebar_float32 = with_dtype(rebar_all, np.float32)(params, (np.log(1.0), np.log(0.3)),
+                                                      dtype_rs.rand(num_samples, D), dtype_rs.rand(num_samples, D),
+                                                      objective)
+    print("  rebar dtypes     : {}".format(sorted(set(np.result_type(x).name
+                                                      for x in rebar_float32[:2] + rebar_float32[2]))))
+    with ThreadPoolExecutor(4) as executor:
+        print("Relax, async f     : {}".format(mc(params, lambda p, n, o: relax_all(p, (0.0, nn_params), n, rs.rand(num_samples, D), o,
+                                                                                     executor=executor)[1])))
+    low_rank_rs = npr.RandomState(0)
+    low_rank_nn_params = init_nn_params(0.1, [D, 5, 1], rs=low_rank_rs, rank=2)
+    print("Relax, low-rank    : {}".format(mc(params, lambda p, n, o: relax_all(p, (0.0, low_rank_nn_params), n,
+                                                                                 low_rank_rs.rand(num_samples, D), o)[1])))
+    selector = EstimatorSelector()
+    selector_est_params = {'rebar': (np.log(1.0), np.log(0.3)), 'relax': (0.0, nn_params)}
+    # The selector compares per-sample gradient variances, so it needs params tiled.
+    print("Auto-selected      : {}".format(mc(params, lambda p, n, o: np.mean(selector(
+        np.tile(p, (num_samples, 1)), selector_est_params, n, low_rank_rs.rand(num_samples, D), o)[1], axis=0))))
+    print("  {}".format(format_decision(selector.decisions[-1])))
+    print("Relax, backend     : {}".format(mc(params, lambda p, n, o: relax_all(p, (0.0, nn_params), n,
+                                                                                 low_rank_rs.rand(num_samples, D), o,
+                                                                                 backend='autograd')[1])))
+    noise_mode_rs = npr.RandomState(0)
+    for label, noise_mode in [("Relax, antithetic  ", 'antithetic'), ("Relax, sobol       ", 'sobol')]:
+        noise_u, noise_v = uniform_noise(noise_mode_rs, num_samples, D, noise_mode)
+        print("{}: {}".format(label, relax_all(params, (0.0, nn_params), noise_u, noise_v, objective)[1]))
 
+    # The variance of the gradients is over samples, so these tile params.
     def var_naive(est_params, method):
         rs = npr.RandomState(0)
         noise_u = rs.rand(num_samples, D)
@@ -65,3 +120,66 @@ if __name__ == '__main__':
     print("\n\nGradient of variance of RELAX gradient:")
     print("Autodiff through variance : {}".format(grad(var_naive)((0.0, nn_params), relax_all)))
     print("Single-sample unbiased    : {}".format(var_grads((0.0, nn_params), relax_all)))
+
+    K = 3
+    cat_params = rs.randn(D, K)
+    cat_targets = np.linspace(0.2, 0.9, D * K).reshape(D, K)
+
+    def cat_objective(b):
+        return np.sum((b - cat_targets)**2, axis=(-2, -1))[:, None]
+
+    def expected_cat_objective(params):
+        log_probs = params - logsumexp(params, axis=-1, keepdims=True)
+        return sum([cat_objective(np.eye(K)[list(b)][None])[0, 0] *
+                    np.exp(np.sum(np.eye(K)[list(b)] * log_probs))
+                    for b in itertools.product(range(K), repeat=D)])
+
+    def cat_mc(est_params, method):
+        rs = npr.RandomState(0)
+        noise_u = rs.rand(num_samples, D, K)
+        noise_v = rs.rand(num_samples, D, K)
+        obj, grads, vargrads = method(cat_params, est_params, noise_u, noise_v, cat_objective)
+        return grads.ravel()
+
+    print("\n\nCategorical gradient estimators:")
+    print("Exact              : {}".format(grad(expected_cat_objective)(cat_params).ravel()))
+    print("Rebar, temp = 1    : {}".format(cat_mc((np.log(1.0), np.log(0.3)), rebar_categorical_all)))
+    print("Relax              : {}".format(cat_mc((0.0, init_nn_params(0.1, [D * K, 5, 1])),
+                                                  relax_categorical_all)))
+
+    layer_sizes = [2, 3, 2]
+    ml_params = (rs.randn(layer_sizes[0]), [(rs.randn(m, n), rs.randn(n))
+                                            for m, n in zip(layer_sizes[:-1], layer_sizes[1:])])
+    ml_targets = [np.linspace(0.2, 0.9, n) for n in layer_sizes]
+
+    def ml_objective(samples):
+        return sum([np.sum((b - t)**2, axis=-1, keepdims=True) for b, t in zip(samples, ml_targets)])
+
+    def expected_ml_objective(params):
+        top_logits, layers = params
+        total = 0.0
+        for bits in itertools.product([0.0, 1.0], repeat=sum(layer_sizes)):
+            samples = np.split(np.array(bits)[None], np.cumsum(layer_sizes)[:-1], axis=1)
+            logits = [top_logits] + [np.dot(2 * b - 1, W)[0] + c for (W, c), b in zip(layers, samples)]
+            log_prob = sum([np.sum(b[0] * l - np.logaddexp(0, l)) for b, l in zip(samples, logits)])
+            total = total + np.exp(log_prob) * ml_objective(samples)[0, 0]
+        return total
+
+    ml_rs = npr.RandomState(0)
+    ml_noise_u = [ml_rs.rand(num_samples, n) for n in layer_sizes]
+    ml_noise_v = [ml_rs.rand(num_samples, n) for n in layer_sizes]
+    ml_est_params = ([0.0] * len(layer_sizes),
+                     [init_nn_params(0.1, [sum(layer_sizes[:l + 1]), 5, 1]) for l in range(len(layer_sizes))])
+    print("\n\nMulti-layer gradient estimators:")
+    print("Exact              : {}".format(flatten(grad(expected_ml_objective)(ml_params))[0]))
+    print("Relax              : {}".format(flatten(relax_multilayer_all(ml_params, ml_est_params, ml_noise_u,
+                                                                        ml_noise_v, ml_objective)[1])[0]))
+
+    # objective_key must not depend on the process, or warm starts never load.
+    key_source = ("from warmstart import objective_key\n"
+                  "def ml_objective(samples):\n"
+                  "    return sum([(b - t)**2 for b, t in zip(samples, (0.1, 0.5))])\n"
+                  "print(objective_key(ml_objective, 3))")
+    keys = [subprocess.check_output([sys.executable, '-c', key_source]).decode().strip()
+            for _ in range(2)]
+    print("\n\nWarm-start keys from two processes: {} {}".format(*keys))
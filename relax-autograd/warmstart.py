@@ -0,0 +1,110 @@
+from __future__ import absolute_import
+import hashlib
+import os
+
+import numpy as onp
+from autograd.misc import flatten
+
+
+def _hash_code(code, digest):
+    # Bytecode, names and constants of code and of the code objects nested in
+    # it (comprehensions, lambdas), never a repr with a memory address.
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        _hash_const(const, digest)
+
+def _hash_const(const, digest):
+    if hasattr(const, 'co_code'):
+        _hash_code(const, digest)
+    elif isinstance(const, (tuple, frozenset)):
+        # frozenset order depends on the process's string hash seed.
+        items = const if isinstance(const, tuple) else sorted(const, key=repr)
+        digest.update(type(const).__name__.encode())
+        for item in items:
+            _hash_const(item, digest)
+    else:
+        digest.update(repr(const).encode())
+
+def objective_key(f, *dims, **kwargs):
+    """Names an objective family and problem size, e.g.
+    objective_key(objective, D, num_hidden_units) -> 'objective-3f9a0c1b2d4e-100x5'.
+
+    The objective is identified by its name and a hash of its bytecode and
+    constants, so editing it starts a new entry; pass name to choose the
+    identity yourself, e.g. when f is a closure over data.
+    """
+    name = kwargs.get('name')
+    if name is None:
+        digest = hashlib.sha1()
+        _hash_code(f.__code__, digest)
+        name = '{}-{}'.format(f.__name__, digest.hexdigest()[:12])
+    return '{}-{}'.format(name, 'x'.join(str(d) for d in dims))
+
+
+class WarmStart(object):
+    """Saves and restores learned estimator state under a key, usually from
+    objective_key, as one .npz file in directory holding float arrays for
+    est_params (which include the temperature) and adam's moments of them.
+
+    save and load take est_params as a tree like the estimators'. With a
+    FlatParams of (params, est_params) and its AdamState, save_flat and
+    load_flat move the est_params part of the buffer and of the moments, so
+    a run resumes both where the last one stopped; params and their moments
+    are left as they are.
+    """
+
+    def __init__(self, key, directory='warm_starts'):
+        self.path = os.path.join(directory, key + '.npz')
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self, est_params, m=None, v=None, steps=None):
+        # m, v and steps are flat, in the order of autograd.misc.flatten(est_params).
+        arrays = {'est_params': flatten(est_params)[0]}
+        if m is not None:
+            arrays.update(m=m, v=v, steps=onp.asarray(steps, onp.int64))
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp_path = self.path + '.tmp.npz'
+        onp.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+
+    def read(self, size):
+        # The saved arrays, or None if there are none of this size.
+        if not self.exists():
+            return None
+        with onp.load(self.path) as saved:
+            arrays = {name: saved[name] for name in saved.files}
+        return arrays if arrays['est_params'].size == size else None
+
+    def load(self, est_params):
+        # Saved est_params with the structure of est_params, or est_params
+        # itself if nothing matching was saved.
+        flat, unflatten = flatten(est_params)
+        saved = self.read(flat.size)
+        if saved is None:
+            return est_params
+        return unflatten(saved['est_params'].astype(flat.dtype))
+
+    def save_flat(self, flat_params, state=None, part=1):
+        span = flat_params.span(part)
+        if state is None:
+            self.save(flat_params.views[part])
+        else:
+            self.save(flat_params.views[part], state.m[span], state.v[span], state.steps[span])
+
+    def load_flat(self, flat_params, state=None, part=1):
+        # Returns whether anything was loaded.
+        span = flat_params.span(part)
+        saved = self.read(span.stop - span.start)
+        if saved is None:
+            return False
+        flat_params.buffer[span] = saved['est_params']
+        if state is not None and 'm' in saved:
+            state.m[span] = saved['m']
+            state.v[span] = saved['v']
+            state.steps[span] = saved['steps']
+        return True